@@ -0,0 +1,436 @@
+"""
+Reproduzierbarer Last-Test fuer den Proxy. Startet die Stub-Server
+(bench/stub_servers.py) und `uvicorn main:app` lokal, fahrt einen Mix aus
+*arr-Polling, NZB-Upload-Bursts und Dashboard-Tabs und schreibt die
+Ergebnisse als JSON (Durchsatz, p50/p95/p99, Peak-RSS, SQLite-Wachstum).
+Laeuft komplett offline auf einer Linux-Maschine.
+
+    python bench/run_bench.py --duration 30 --arr-instances 6 --tabs 4
+    python bench/run_bench.py --compare bench/results/<alt>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def make_nzb(size: int, seed: int) -> bytes:
+    """Synthetische NZB mit ungefaehr `size` Bytes."""
+    head = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">\n'
+        f'<file poster="bench" date="{seed}" subject="bench {seed}"><segments>\n'
+    )
+    tail = "</segments></file>\n</nzb>\n"
+    segment = '<segment bytes="768000" number="{n}">{n}.{seed}@bench</segment>\n'
+    parts, total, n = [head], len(head) + len(tail), 0
+    while total < size:
+        line = segment.format(n=n, seed=seed)
+        parts.append(line)
+        total += len(line)
+        n += 1
+    parts.append(tail)
+    return "".join(parts).encode()
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().lower()
+    factor = {"k": 1024, "m": 1024**2}.get(value[-1], 1)
+    return int(float(value.rstrip("km")) * factor)
+
+
+def child_pids(pid: int) -> List[int]:
+    """Alle Nachfahren von `pid` (uvicorn --workers startet Kindprozesse)."""
+    parents: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Feld 4 ist die PPID; comm in Klammern kann Leerzeichen enthalten
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    result, todo = [], [pid]
+    while todo:
+        children = parents.get(todo.pop(), [])
+        result.extend(children)
+        todo.extend(children)
+    return result
+
+
+def process_tree_rss_kb(pid: int) -> int:
+    return sum(read_rss_kb(p) for p in [pid, *child_pids(pid)])
+
+
+def read_rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def count_rows(db_path: str) -> Dict[str, int]:
+    if not os.path.exists(db_path):
+        return {}
+    with sqlite3.connect(db_path) as conn:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("history", "torbox_cache")
+        }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, scenario: str, seconds: float, ok: bool):
+        self.latencies.setdefault(scenario, []).append(seconds)
+        if not ok:
+            self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, Dict]:
+        result = {}
+        for scenario, values in sorted(self.latencies.items()):
+            result[scenario] = {
+                "requests": len(values),
+                "errors": self.errors.get(scenario, 0),
+                "throughput_rps": round(len(values) / duration, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2),
+            }
+        return result
+
+
+async def pause(stop: asyncio.Event, seconds: float):
+    """Wie asyncio.sleep, endet aber sofort, sobald `stop` gesetzt wird."""
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def timed(recorder: Recorder, scenario: str, coro):
+    started = time.perf_counter()
+    try:
+        resp = await coro
+        ok = resp.status_code < 400
+    except httpx.HTTPError:
+        ok = False
+    recorder.add(scenario, time.perf_counter() - started, ok)
+
+
+async def arr_poller(client, recorder, stop, interval, apikey):
+    # Versatz, damit nicht alle Instanzen im selben Takt pollen
+    await pause(stop, random.random() * interval)
+    while not stop.is_set():
+        for mode in ("queue", "history"):
+            await timed(
+                recorder,
+                f"api_{mode}",
+                client.get("/api", params={"mode": mode, "apikey": apikey}),
+            )
+        await pause(stop, interval)
+
+
+async def uploader(client, recorder, stop, every, burst, sizes):
+    seq = 0
+    while not stop.is_set():
+        tasks = []
+        for _ in range(burst):
+            seq += 1
+            size = sizes[seq % len(sizes)]
+            nzb = make_nzb(size, seq)
+            tasks.append(
+                timed(
+                    recorder,
+                    "api_addfile",
+                    client.post(
+                        "/api",
+                        params={"mode": "addfile", "apikey": "bench"},
+                        data={"cat": "tv"},
+                        files={"nzbfile": (f"Bench.Upload.{seq}.nzb", nzb)},
+                    ),
+                )
+            )
+        await asyncio.gather(*tasks)
+        await pause(stop, every)
+
+
+async def dashboard_tab(client, recorder, stop, interval, search):
+    etag: Optional[str] = None
+    await pause(stop, random.random() * interval)
+    while not stop.is_set():
+        headers = {"If-None-Match": etag} if etag else {}
+        started = time.perf_counter()
+        try:
+            resp = await client.get(
+                "/",
+                params={"content_only": 1, "search_t": search, "search_h": search},
+                headers=headers,
+            )
+            etag = resp.headers.get("etag", etag)
+            ok = resp.status_code in (200, 304)
+        except httpx.HTTPError:
+            ok = False
+        recorder.add("dashboard_content", time.perf_counter() - started, ok)
+        await pause(stop, interval)
+
+
+async def rss_sampler(pid, stop, peak):
+    while not stop.is_set():
+        peak[0] = max(peak[0], process_tree_rss_kb(pid))
+        await asyncio.sleep(0.25)
+
+
+async def wait_ready(url: str, timeout: float = 30.0, interval: float = 0.2):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                resp = await client.get(url, timeout=1.0)
+                if resp.status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(interval)
+    raise RuntimeError(f"{url} nicht erreichbar")
+
+
+async def run_load(args, proxy_pid: int) -> Dict:
+    recorder = Recorder()
+    stop = asyncio.Event()
+    peak = [0]
+    limits = httpx.Limits(max_connections=200, max_keepalive_connections=100)
+    base = f"http://127.0.0.1:{args.proxy_port}"
+    sizes = [parse_size(s) for s in args.upload_sizes.split(",")]
+
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+        client.cookies.set("user", "admin")
+        tasks = [asyncio.create_task(rss_sampler(proxy_pid, stop, peak))]
+        for i in range(args.arr_instances):
+            tasks.append(
+                asyncio.create_task(
+                    arr_poller(client, recorder, stop, args.arr_interval, f"arr{i}")
+                )
+            )
+        if args.upload_burst > 0:
+            tasks.append(
+                asyncio.create_task(
+                    uploader(
+                        client,
+                        recorder,
+                        stop,
+                        args.upload_every,
+                        args.upload_burst,
+                        sizes,
+                    )
+                )
+            )
+        for i in range(args.tabs):
+            search = "" if i % 2 == 0 else "s01"
+            tasks.append(
+                asyncio.create_task(
+                    dashboard_tab(client, recorder, stop, args.tab_interval, search)
+                )
+            )
+
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_s": round(elapsed, 2),
+        # Durchsatz ueber das konfigurierte Lastfenster, nicht inkl. Auslaufen
+        "scenarios": recorder.summary(args.duration),
+        "total_requests": sum(len(v) for v in recorder.latencies.values()),
+        "peak_rss_kb": peak[0],
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_comparison(current: Dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nVergleich mit {baseline_path} ({baseline.get('revision')}):")
+    for scenario, stats in current["result"]["scenarios"].items():
+        old = baseline["result"]["scenarios"].get(scenario)
+        if not old:
+            continue
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            before, after = old[key], stats[key]
+            delta = ((after - before) / before * 100) if before else 0.0
+            print(
+                f"  {scenario:20s} {key:15s} {before:10.2f} -> {after:10.2f}"
+                f" ({delta:+.1f}%)"
+            )
+    if "cold_start_ms" in baseline["result"]:
+        before = baseline["result"]["cold_start_ms"]
+        after = current["result"]["cold_start_ms"]
+        print(
+            f"  {'startup':20s} {'cold_start_ms':15s} {before:10.2f} -> {after:10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--proxy-port", type=int, default=9200)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--arr-instances", type=int, default=6)
+    parser.add_argument("--arr-interval", type=float, default=1.0)
+    parser.add_argument("--upload-burst", type=int, default=5)
+    parser.add_argument("--upload-every", type=float, default=5.0)
+    parser.add_argument("--upload-sizes", default="50k,1m,10m")
+    parser.add_argument("--tabs", type=int, default=4)
+    parser.add_argument("--tab-interval", type=float, default=5.0)
+    parser.add_argument("--backend-latency", type=float, default=0.02)
+    parser.add_argument("--backend-failure-rate", type=float, default=0.0)
+    parser.add_argument("--torbox-items", type=int, default=2000)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="proxy-bench-")
+    db_dir = os.path.join(workdir, "db")
+    blackhole = os.path.join(workdir, "blackhole")
+    os.makedirs(db_dir)
+    os.makedirs(blackhole)
+    db_path = os.path.join(db_dir, "proxy_altmount.db")
+
+    stub = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(REPO_DIR, "bench", "stub_servers.py"),
+            "--port",
+            str(args.stub_port),
+            "--latency",
+            str(args.backend_latency),
+            "--failure-rate",
+            str(args.backend_failure_rate),
+            "--torbox-items",
+            str(args.torbox_items),
+        ]
+    )
+    env = dict(
+        os.environ,
+        BACKEND_URL=f"http://127.0.0.1:{args.stub_port}/sabnzbd",
+        TORBOX_API_URL=f"http://127.0.0.1:{args.stub_port}/v1/api/usenet/mylist",
+        TORBOX_API_KEY="bench",
+        DATABASE_DIR=db_dir,
+        BLACKHOLE_DIR=blackhole,
+        PROXY_USER="admin",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    try:
+        asyncio.run(wait_ready(f"http://127.0.0.1:{args.stub_port}/_stats"))
+    except RuntimeError:
+        stub.terminate()
+        raise
+    spawned = time.perf_counter()
+    proxy = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.proxy_port),
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=REPO_DIR,
+        env=env,
+    )
+
+    try:
+        # Kaltstart: Prozessstart bis /ready 200 liefert
+        asyncio.run(
+            wait_ready(f"http://127.0.0.1:{args.proxy_port}/ready", interval=0.02)
+        )
+        cold_start_ms = (time.perf_counter() - spawned) * 1000
+        time.sleep(1.0)  # erster TorBox-Sync
+        rows_before = count_rows(db_path)
+        result = asyncio.run(run_load(args, proxy.pid))
+        time.sleep(1.0)  # History-Writer leeren lassen
+        rows_after = count_rows(db_path)
+        stub_stats = httpx.get(f"http://127.0.0.1:{args.stub_port}/_stats").json()
+    finally:
+        proxy.terminate()
+        stub.terminate()
+        proxy.wait(timeout=30)
+        stub.wait(timeout=30)
+
+    result["cold_start_ms"] = round(cold_start_ms, 1)
+    result["sqlite_rows_before"] = rows_before
+    result["sqlite_rows_after"] = rows_after
+    result["db_size_bytes"] = os.path.getsize(db_path) if os.path.exists(db_path) else 0
+    result["backend_stats"] = stub_stats
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "result": result,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['revision']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(result, indent=2))
+    print(f"\nErgebnis gespeichert: {output}")
+    if args.compare:
+        print_comparison(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Lokale Stub-Server fuer den Benchmark: imitiert Altmount (SABnzbd-API unter
+/sabnzbd) und die TorBox-Liste (/v1/api/usenet/mylist) in einem Prozess.
+
+    python bench/stub_servers.py --port 9100 --latency 0.02 \
+        --failure-rate 0.01 --torbox-items 2000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_stub_app(
+    latency: float, jitter: float, failure_rate: float, torbox_items: int, slots: int
+) -> FastAPI:
+    app = FastAPI()
+    stats = {"requests": 0, "uploads": 0, "upload_bytes": 0, "torbox_requests": 0}
+
+    queue_slots = [
+        {
+            "nzo_id": f"SABnzbd_nzo_{i}",
+            "filename": f"Some.Show.S01E{i:02d}.1080p.WEB.nzb",
+            "status": "Downloading",
+            "mb": "1024",
+            "mbleft": "512",
+            "percentage": "50",
+        }
+        for i in range(slots)
+    ]
+    history_slots = [
+        {
+            "nzo_id": f"SABnzbd_nzo_h{i}",
+            "name": f"Some.Movie.{i}.2160p.nzb",
+            "status": "Completed",
+            "bytes": 1024**3,
+        }
+        for i in range(slots)
+    ]
+
+    async def simulate():
+        delay = max(0.0, random.gauss(latency, jitter))
+        if delay:
+            await asyncio.sleep(delay)
+        return random.random() < failure_rate
+
+    @app.api_route("/sabnzbd", methods=["GET", "POST"])
+    @app.api_route("/sabnzbd/api", methods=["GET", "POST"])
+    async def sabnzbd(request: Request):
+        stats["requests"] += 1
+        mode = request.query_params.get("mode")
+        if request.method == "POST":
+            form = await request.form()
+            for value in form.values():
+                if hasattr(value, "read"):
+                    stats["uploads"] += 1
+                    while chunk := await value.read(256 * 1024):
+                        stats["upload_bytes"] += len(chunk)
+        if await simulate():
+            return JSONResponse({"status": False, "error": "stub failure"}, 500)
+        if mode in ("addfile", "addurl"):
+            return {"status": True, "nzo_ids": [f"SABnzbd_nzo_{time.time_ns()}"]}
+        if mode == "queue":
+            return {"queue": {"status": "Downloading", "slots": queue_slots}}
+        if mode == "history":
+            return {
+                "history": {"slots": history_slots, "noofslots": len(history_slots)}
+            }
+        if mode == "version":
+            return {"version": "4.3.0"}
+        return {"status": True, "config": {"misc": {"complete_dir": "/downloads"}}}
+
+    @app.get("/v1/api/usenet/mylist")
+    async def torbox_mylist():
+        stats["torbox_requests"] += 1
+        if await simulate():
+            return JSONResponse({"success": False}, 500)
+        states = ("downloading", "completed", "cached", "processing")
+        return {
+            "data": [
+                {
+                    "id": i + 1,
+                    "name": f"Release.Name.{i}.S{i % 20:02d}E{i % 30:02d}.1080p",
+                    "progress": 1.0 if i % 4 else random.random(),
+                    "download_state": states[i % len(states)],
+                }
+                for i in range(torbox_items)
+            ]
+        }
+
+    @app.get("/_stats")
+    async def stub_stats():
+        return stats
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--torbox-items", type=int, default=500)
+    parser.add_argument("--slots", type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_stub_app(
+        args.latency, args.jitter, args.failure_rate, args.torbox_items, args.slots
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
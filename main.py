@@ -6,7 +6,26 @@ import os
 import time
 import re
 import shutil
+import queue
+import threading
+import zlib
+import gzip
+import json
+import hashlib
+import logging
+import logging.handlers
+import contextvars
+import uuid
+import atexit
+import signal
+import bisect
+import functools
+import tarfile
+import tempfile
+import zipfile
+from contextlib import asynccontextmanager
 from fastapi import (
+    APIRouter,
     FastAPI,
     Request,
     Depends,
@@ -16,13 +35,29 @@ from fastapi import (
     UploadFile,
     File,
 )
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    JSONResponse,
+    StreamingResponse,
+    Response,
+)
 from fastapi.templating import Jinja2Templates
 from typing import Optional, Any, List, Dict
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional: ohne brotli wird nur gzip angeboten
+    brotli = None
 
 
 # --- KONFIGURATION ---
 TORBOX_API_KEY = str(os.getenv("TORBOX_API_KEY", ""))
+TORBOX_API_URL = str(
+    os.getenv("TORBOX_API_URL", "https://api.torbox.app/v1/api/usenet/mylist")
+)
 DATABASE_DIR = str(os.getenv("DATABASE_DIR", "./"))
 DB_PATH = os.path.join(DATABASE_DIR, "proxy_altmount.db")
 BLACKHOLE_DIR = str(os.getenv("BLACKHOLE_DIR", "/blackhole"))
@@ -30,146 +65,2116 @@ PROXY_USER = str(os.getenv("PROXY_USER", "admin"))
 PROXY_PASS = str(os.getenv("PROXY_PASS", "password"))
 ITEMS_PER_PAGE = 10
 BACKEND_URL = str(os.getenv("BACKEND_URL", "http://altmount:8080/sabnzbd"))
+# Mehrere Altmount-Instanzen kommagetrennt; die erste ist der Upload-Primary
+BACKEND_URLS = [u.strip() for u in BACKEND_URL.split(",") if u.strip()]
+BACKEND_HEALTH_INTERVAL = float(os.getenv("BACKEND_HEALTH_INTERVAL", "10"))
+BACKEND_HEALTH_TIMEOUT = float(os.getenv("BACKEND_HEALTH_TIMEOUT", "2"))
+# Optionaler SAB-API-Key fuer die Health-Probe (mode=version)
+BACKEND_API_KEY = str(os.getenv("BACKEND_API_KEY", ""))
+# Maximale Anzahl Backends, die pro Anfrage nacheinander versucht werden
+BACKEND_MAX_ATTEMPTS = int(os.getenv("BACKEND_MAX_ATTEMPTS", "2"))
+# TorBox-Polling: schnell solange Downloads laufen, langsam wenn alles fertig ist
+TORBOX_POLL_ACTIVE = float(os.getenv("TORBOX_POLL_ACTIVE", "5"))
+TORBOX_POLL_IDLE = float(os.getenv("TORBOX_POLL_IDLE", "60"))
+TORBOX_POLL_MAX_BACKOFF = float(os.getenv("TORBOX_POLL_MAX_BACKOFF", "300"))
+# Multi-Worker: nur der Lease-Inhaber pollt TorBox, alle anderen lesen den
+# geteilten Stand aus torbox_cache, sobald sich torbox_meta.version aendert
+TORBOX_LEASE_TTL = float(os.getenv("TORBOX_LEASE_TTL", "15"))
+TORBOX_SHARED_CHECK = float(os.getenv("TORBOX_SHARED_CHECK", "2"))
+TORBOX_DONE_STATES = ("COMPLETED", "FINISHED", "CACHED", "SEEDING")
+# Chunk-Groesse beim Spoolen von NZB-Uploads (begrenzt den Speicher pro Upload)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+# Identische NZBs (SHA-256) innerhalb dieses Fensters nicht erneut einreichen (0 = aus)
+NZB_DEDUP_WINDOW_HOURS = float(os.getenv("NZB_DEDUP_WINDOW_HOURS", "24"))
+# History-Writer: Zeilen werden gesammelt und gebuendelt committet
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+HISTORY_FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", "250"))
+# Busy-Timeout (Sekunden) der Writer-Verbindung, z.B. waehrend der Wartung
+HISTORY_BUSY_TIMEOUT = float(os.getenv("HISTORY_BUSY_TIMEOUT", "30"))
+# Retention: Nicht-Upload-Modes (queue, history, ...) landen nur als Stunden-
+# Zaehler in history_hourly. Mit HISTORY_POLL_RAW_HOURS > 0 werden sie
+# zusaetzlich so lange als Einzelzeilen fuer die ungefilterte Ansicht behalten
+HISTORY_POLL_RAW_HOURS = float(os.getenv("HISTORY_POLL_RAW_HOURS", "0"))
+# Upload-Zeilen wandern nach so vielen Tagen in history_archive
+HISTORY_ARCHIVE_DAYS = float(os.getenv("HISTORY_ARCHIVE_DAYS", "90"))
+HISTORY_MAINTENANCE_INTERVAL = float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", "3600"))
+HISTORY_MAINTENANCE_CHUNK = 5000
+# Wie oft die Per-Mode-Summen im Dashboard hoechstens aktualisiert werden
+HISTORY_STATS_INTERVAL = float(os.getenv("HISTORY_STATS_INTERVAL", "60"))
+HISTORY_VACUUM_PAGES = int(os.getenv("HISTORY_VACUUM_PAGES", "2000"))
+# Server-Sent Events fuer das Dashboard
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))
+SSE_MIN_INTERVAL = float(os.getenv("SSE_MIN_INTERVAL", "1"))
+# Maximale Laufzeit eines Streams; EventSource verbindet sich danach neu
+SSE_MAX_LIFETIME = float(os.getenv("SSE_MAX_LIFETIME", "300"))
+# Anzahl gecachter Dashboard-Fragmente (content_only)
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "64"))
+# Bulk-Import: parallele Weiterleitungen an Altmount und Grenzen pro Import
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "8"))
+IMPORT_MAX_FILES = int(os.getenv("IMPORT_MAX_FILES", "2000"))
+IMPORT_MAX_FILE_SIZE = int(os.getenv("IMPORT_MAX_FILE_SIZE", str(64 * 1024 * 1024)))
+# Wurzel fuer den Verzeichnis-Import (/import?directory=...); leer = deaktiviert
+IMPORT_DIR = str(os.getenv("IMPORT_DIR", ""))
+# Komprimierung der JSON-Antworten (/api, content_only) ab dieser Groesse
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "5"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Connection-Pool fuer die Weiterleitung an Altmount
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "20"))
+BACKEND_MAX_KEEPALIVE = int(os.getenv("BACKEND_MAX_KEEPALIVE", "10"))
+BACKEND_KEEPALIVE_EXPIRY = float(os.getenv("BACKEND_KEEPALIVE_EXPIRY", "30"))
+# Timeouts pro SAB-Mode, z.B. "queue=3,history=5,addfile=30"
+BACKEND_TIMEOUT_DEFAULT = float(os.getenv("BACKEND_TIMEOUT_DEFAULT", "5"))
+BACKEND_TIMEOUTS: Dict[str, float] = {"addfile": 15.0, "addurl": 15.0}
+for _entry in str(os.getenv("BACKEND_TIMEOUTS", "")).split(","):
+    if "=" in _entry:
+        _mode, _value = _entry.split("=", 1)
+        BACKEND_TIMEOUTS[_mode.strip()] = float(_value)
+# Circuit Breaker: nach N Fehlern fuer X Sekunden direkt den Fallback liefern
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+UPLOAD_MODES = ("addfile", "addurl")
+# Read-only Modes ohne Cache; alles andere invalidiert den Response-Cache
+READ_ONLY_MODES = ("auth", "fullstatus", "server_stats", "warnings", "get_scripts")
+# Response-Cache TTLs (Sekunden) pro read-only Mode, z.B. "queue=2,version=300"
+CACHE_TTLS: Dict[str, float] = {
+    "queue": 2.0,
+    "history": 5.0,
+    "get_config": 30.0,
+    "get_cats": 30.0,
+    "version": 300.0,
+}
+for _entry in str(os.getenv("CACHE_TTLS", "")).split(","):
+    if "=" in _entry:
+        _mode, _value = _entry.split("=", 1)
+        CACHE_TTLS[_mode.strip()] = float(_value)
+
+# --- LOGGING ---
+LOG_LEVEL = str(os.getenv("LOG_LEVEL", "INFO")).upper()
+LOG_FORMAT = str(os.getenv("LOG_FORMAT", "text")).lower()  # text | json
+# Werte dieser Felder werden in Logs nie im Klartext ausgegeben
+REDACTED_FIELDS = ("apikey", "api_key", "nzbkey", "password")
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar(
+    "request_id", default="-"
+)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
 
-# Startup Logging
-print("\n" + "=" * 60)
-print("PROXY STARTUP - KONFIGURATION")
-print("=" * 60)
-print(f"DATABASE_DIR: {DATABASE_DIR}")
-print(f"DB_PATH: {DB_PATH}")
-print(f"BLACKHOLE_DIR: {BLACKHOLE_DIR}")
-print(f"PROXY_USER: {PROXY_USER}")
-print(
-    f"TORBOX_API_KEY: {'***' + TORBOX_API_KEY[-10:] if len(TORBOX_API_KEY) > 10 else 'NOT SET'}"
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """
+    Haengt nur die Request-ID an und reicht den Record unformatiert in die
+    Queue; Formatierung und stdout-I/O passieren im Listener-Thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        return record
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    global log_listener
+    if log_listener is not None:
+        return log_listener
+    stream = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(
+            logging.Formatter(
+                "%(asctime)s %(levelname)-7s [%(name)s] [%(request_id)s] %(message)s"
+            )
+        )
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    root = logging.getLogger("proxy")
+    root.handlers = [RequestQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    log_listener = listener
+    return listener
+
+
+def redact(values: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        k: ("***" if k.lower() in REDACTED_FIELDS else v) for k, v in values.items()
+    }
+
+
+# Wird erst im Lifespan gestartet, damit ein Import keinen Thread startet
+log_listener: Optional[logging.handlers.QueueListener] = None
+log = logging.getLogger("proxy")
+api_log = logging.getLogger("proxy.api")
+db_log = logging.getLogger("proxy.db")
+torbox_log = logging.getLogger("proxy.torbox")
+
+# --- METRICS (Prometheus-Textformat) ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 5e7, 1e8)
+# Bekannte SAB-Modes; alles andere wird als "other" gezaehlt (begrenzte Labels)
+KNOWN_MODES = frozenset(
+    (
+        "queue",
+        "history",
+        "version",
+        "get_config",
+        "get_cats",
+        "get_scripts",
+        "fullstatus",
+        "status",
+        "server_stats",
+        "warnings",
+        "auth",
+        "addfile",
+        "addurl",
+        "pause",
+        "resume",
+        "change_cat",
+        "retry",
+    )
 )
-print("=" * 60 + "\n")
 
-# Erstelle Blackhole-Verzeichnis
-if not os.path.exists(BLACKHOLE_DIR):
-    os.makedirs(BLACKHOLE_DIR, exist_ok=True)
-    print(f"[STARTUP] Blackhole-Verzeichnis erstellt: {BLACKHOLE_DIR}")
-else:
-    print(f"[STARTUP] Blackhole-Verzeichnis existiert: {BLACKHOLE_DIR}")
 
-# Ueberpruefe Schreibrechte
-try:
-    test_file = os.path.join(BLACKHOLE_DIR, ".write_test")
-    with open(test_file, "w") as f:
-        f.write("test")
-    os.remove(test_file)
-    print(f"[STARTUP] Schreibrechte OK: {BLACKHOLE_DIR}")
-except Exception as e:
-    print(f"[STARTUP ERROR] Keine Schreibrechte in {BLACKHOLE_DIR}: {e}")
+class Counter:
+    __slots__ = ("value",)
 
-print(f"[STARTUP] Absolute Pfad: {os.path.abspath(BLACKHOLE_DIR)}")
-print()
+    def __init__(self):
+        self.value = 0.0
 
+    def inc(self, amount: float = 1.0):
+        self.value += amount
 
-torbox_memory_cache: List[Dict] = []
+
+class Gauge(Counter):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """Histogramm mit vorab allozierten Buckets (nicht-kumulativ gespeichert)."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricFamily:
+    """
+    Eine Metrik mit festen Label-Namen. Kind-Metriken werden pro
+    Label-Tupel einmal angelegt und danach nur noch nachgeschlagen.
+    """
+
+    def __init__(self, name: str, kind: str, help_text: str, labelnames=(), **kwargs):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.kwargs = kwargs
+        self.children: Dict[tuple, Any] = {}
+        metrics_registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            factory = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+            child = self.children[values] = factory[self.kind](**self.kwargs)
+        return child
+
+    def render(self, out: List[str]):
+        out.append(f"# HELP {self.name} {self.help_text}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in list(self.children.items()):
+            pairs = [f'{k}="{v}"' for k, v in zip(self.labelnames, values)]
+            labels = "{" + ",".join(pairs) + "}" if pairs else ""
+            if self.kind != "histogram":
+                out.append(f"{self.name}{labels} {child.value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(child.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = ",".join(pairs + [f'le="{le}"'])
+                out.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            out.append(f"{self.name}_sum{labels} {child.sum}")
+            out.append(f"{self.name}_count{labels} {child.count}")
+
+
+metrics_registry: List[MetricFamily] = []
+
+API_LATENCY = MetricFamily(
+    "proxy_api_request_seconds",
+    "histogram",
+    "Dauer der /api-Anfragen nach SAB-Mode und Ergebnis",
+    ("mode", "outcome"),
+)
+BACKEND_LATENCY = MetricFamily(
+    "proxy_backend_request_seconds",
+    "histogram",
+    "Dauer der Weiterleitungen an Altmount",
+    ("backend", "method"),
+)
+BACKEND_RESPONSES = MetricFamily(
+    "proxy_backend_responses_total",
+    "counter",
+    "Antworten von Altmount nach Statuscode",
+    ("backend", "code"),
+)
+BACKEND_HEALTHY = MetricFamily(
+    "proxy_backend_healthy", "gauge", "Ergebnis der letzten Health-Probe", ("backend",)
+)
+UPLOAD_BYTES = MetricFamily(
+    "proxy_upload_bytes", "histogram", "Groesse der NZB-Uploads", buckets=SIZE_BUCKETS
+)
+HISTORY_WRITE = MetricFamily(
+    "proxy_history_write_seconds", "histogram", "Dauer eines History-Batch-Commits"
+)
+HISTORY_ROWS = MetricFamily(
+    "proxy_history_rows_written_total", "counter", "Geschriebene History-Zeilen"
+)
+HISTORY_READ = MetricFamily(
+    "proxy_history_read_seconds", "histogram", "Dauer der Dashboard-History-Abfrage"
+)
+TORBOX_FETCH = MetricFamily(
+    "proxy_torbox_fetch_seconds", "histogram", "Dauer eines TorBox-Syncs"
+)
+TORBOX_ITEMS = MetricFamily(
+    "proxy_torbox_items", "gauge", "Eintraege im TorBox-Snapshot"
+)
+TORBOX_ERROR_STREAK = MetricFamily(
+    "proxy_torbox_error_streak", "gauge", "Fehlgeschlagene TorBox-Abfragen in Folge"
+)
+HISTORY_MAINTENANCE = MetricFamily(
+    "proxy_history_maintenance_seconds",
+    "histogram",
+    "Dauer eines Retention/Vacuum-Laufs",
+    buckets=(0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0),
+)
+STARTUP_SECONDS = MetricFamily(
+    "proxy_startup_seconds", "gauge", "Dauer der Lifespan-Initialisierung"
+)
+EVENT_LOOP_LAG = MetricFamily(
+    "proxy_event_loop_lag_seconds", "histogram", "Verzoegerung des Event-Loops"
+)
+
+
+def mode_label(mode: Optional[str]) -> str:
+    return mode if mode in KNOWN_MODES else "other"
+
+
+def render_metrics() -> str:
+    out: List[str] = []
+    for family in metrics_registry:
+        family.render(out)
+    return "\n".join(out) + "\n"
+
+
+def log_config():
+    """Gibt die wirksame Konfiguration beim Start aus."""
+    log.info("PROXY STARTUP - KONFIGURATION")
+    log.info("DATABASE_DIR: %s", DATABASE_DIR)
+    log.info("DB_PATH: %s", DB_PATH)
+    log.info("BLACKHOLE_DIR: %s", BLACKHOLE_DIR)
+    log.info("PROXY_USER: %s", PROXY_USER)
+    log.info("BACKEND_URLS: %s", BACKEND_URLS)
+    log.info(
+        "BACKEND_POOL: max=%s keepalive=%s",
+        BACKEND_MAX_CONNECTIONS,
+        BACKEND_MAX_KEEPALIVE,
+    )
+    log.info(
+        "BACKEND_TIMEOUTS: %s (default %s)", BACKEND_TIMEOUTS, BACKEND_TIMEOUT_DEFAULT
+    )
+    log.info(
+        "TORBOX_API_KEY: %s",
+        "***" + TORBOX_API_KEY[-10:] if len(TORBOX_API_KEY) > 10 else "NOT SET",
+    )
+    log.info("LOG_LEVEL: %s, LOG_FORMAT: %s", LOG_LEVEL, LOG_FORMAT)
+
+
+def prepare_blackhole() -> bool:
+    """Legt das Blackhole an und prueft die Schreibrechte (blockierend)."""
+    if not os.path.exists(BLACKHOLE_DIR):
+        os.makedirs(BLACKHOLE_DIR, exist_ok=True)
+        log.info("Blackhole-Verzeichnis erstellt: %s", BLACKHOLE_DIR)
+    else:
+        log.info("Blackhole-Verzeichnis existiert: %s", BLACKHOLE_DIR)
+    log.info("Absolute Pfad: %s", os.path.abspath(BLACKHOLE_DIR))
+
+    try:
+        test_file = os.path.join(BLACKHOLE_DIR, ".write_test")
+        with open(test_file, "w") as f:
+            f.write("test")
+        os.remove(test_file)
+        log.info("Schreibrechte OK: %s", BLACKHOLE_DIR)
+        return True
+    except Exception as e:
+        log.error("Keine Schreibrechte in %s: %s", BLACKHOLE_DIR, e)
+        return False
+
+
+torbox_snapshot: Optional["TorboxSnapshot"] = None
 last_api_fetch = 0
+# True, wenn die letzte TorBox-Abfrage fehlschlug und der Cache veraltet ist
+torbox_stale = False
+# Letzter in torbox_cache geschriebener Stand: TorBox-ID -> (name, progress, state)
+torbox_db_rows: Optional[Dict[int, tuple]] = None
+torbox_error_streak = 0
+# Eindeutige Kennung dieses Workers fuer die Poller-Lease
+POLLER_ID = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 cache_lock = asyncio.Lock()
 
-app = FastAPI()
+
+class CircuitBreaker:
+    """
+    Einfacher Circuit Breaker fuer das Altmount-Backend.
+    closed -> open nach `threshold` Fehlern in Folge, nach `reset_timeout`
+    wird ein einzelner Probe-Request durchgelassen (half-open).
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float, name: str = "Altmount"):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            api_log.warning(
+                "%s nicht erreichbar - gesperrt fuer %ss", self.name, self.reset_timeout
+            )
+
+
+backend_client: Optional[httpx.AsyncClient] = None
+
+
+class Backend:
+    """Eine Altmount-Instanz mit eigenem Breaker und Laufzeit-Statistik."""
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, url: str):
+        self.url = url
+        self.breaker = CircuitBreaker(
+            BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, name=url
+        )
+        self.healthy = True
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.breaker.state != "open"
+
+    def observe(self, seconds: float):
+        if self.ewma == 0.0:
+            self.ewma = seconds
+        else:
+            self.ewma = self.EWMA_ALPHA * seconds + (1 - self.EWMA_ALPHA) * self.ewma
+
+
+class BackendPool:
+    """
+    Verteilt read-only Modes nach wenigsten offenen Anfragen (danach EWMA-
+    Latenz) und schickt Uploads an den Primary mit Failover in Listenreihenfolge.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.backends = [Backend(url) for url in urls]
+        # Zaehlt Zustandswechsel (gesund/nicht erreichbar) fuer Dashboard-ETags
+        self.health_version = 0
+
+    def read_candidates(self) -> List[Backend]:
+        available = [b for b in self.backends if b.available]
+        return sorted(available, key=lambda b: (b.outstanding, b.ewma))
+
+    def upload_candidates(self) -> List[Backend]:
+        return [b for b in self.backends if b.available]
+
+    async def probe(self, client: httpx.AsyncClient, backend: Backend):
+        started = time.perf_counter()
+        try:
+            params = {"mode": "version", "output": "json"}
+            if BACKEND_API_KEY:
+                params["apikey"] = BACKEND_API_KEY
+            resp = await client.get(
+                backend.url, params=params, timeout=BACKEND_HEALTH_TIMEOUT
+            )
+            # Wie in _forward_once: 4xx (z.B. fehlender API-Key) heisst, das
+            # Backend antwortet; nur 5xx und Verbindungsfehler sind ungesund
+            healthy = resp.status_code < 500
+        except Exception:
+            healthy = False
+        if healthy:
+            backend.observe(time.perf_counter() - started)
+            backend.breaker.record_success()
+        if healthy != backend.healthy:
+            api_log.warning(
+                "Backend %s ist %s",
+                backend.url,
+                "gesund" if healthy else "nicht erreichbar",
+            )
+            backend.healthy = healthy
+            self.health_version += 1
+            dashboard_events.notify()
+        BACKEND_HEALTHY.labels(backend.url).set(1 if healthy else 0)
+
+    async def probe_all(self, client: httpx.AsyncClient):
+        await asyncio.gather(*(self.probe(client, b) for b in self.backends))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "url": b.url,
+                "primary": i == 0,
+                "healthy": b.healthy,
+                "breaker": b.breaker.state,
+                "outstanding": b.outstanding,
+                "ewma_ms": round(b.ewma * 1000, 1),
+                "requests": b.requests,
+                "failures": b.failures,
+            }
+            for i, b in enumerate(self.backends)
+        ]
+
+
+backend_pool = BackendPool(BACKEND_URLS)
+
+
+def get_backend_timeout(mode: Optional[str]) -> float:
+    return BACKEND_TIMEOUTS.get(str(mode), BACKEND_TIMEOUT_DEFAULT)
+
+
+class ResponseCache:
+    """
+    TTL-Cache fuer read-only SAB-Modes mit Single-Flight: laufen mehrere
+    identische Anfragen gleichzeitig, geht nur eine davon an Altmount.
+    Fallback-Antworten (None) werden nicht gecacht.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: Dict[tuple, tuple] = {}
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        self.generation = 0
+
+    async def get_or_fetch(self, key: tuple, ttl: float, fetch) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        pending = self.inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        generation = self.generation
+        value = None
+        try:
+            value = await fetch()
+            # Nur cachen, wenn zwischendurch nicht invalidiert wurde
+            if value is not None and ttl > 0 and generation == self.generation:
+                if len(self.entries) >= self.max_entries:
+                    self._prune()
+                self.entries[key] = (time.monotonic() + ttl, value)
+            return value
+        finally:
+            self.inflight.pop(key, None)
+            future.set_result(value)
+
+    def invalidate(self):
+        self.entries.clear()
+        self.generation += 1
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, v in self.entries.items() if v[0] <= now]:
+            del self.entries[key]
+        if len(self.entries) >= self.max_entries:
+            self.entries.clear()
+
+
+def mutates_backend(mode: Optional[str], params: Dict[str, str]) -> bool:
+    """
+    True fuer alles, was in Altmount etwas aendert: Uploads, Aktionen ueber
+    `name` (queue/history name=delete|pause|resume|priority, ...) und alle
+    Modes, die nicht als read-only bekannt sind.
+    """
+    if mode in UPLOAD_MODES or "name" in params:
+        return True
+    return mode not in CACHE_TTLS and mode not in READ_ONLY_MODES
+
+
+def make_cache_key(params: Dict[str, str]) -> tuple:
+    # apikey gehoert nicht zum Cache-Key, sonst teilen sich die *arrs nichts
+    return tuple(sorted((k, v) for k, v in params.items() if k.lower() != "apikey"))
+
+
+response_cache = ResponseCache()
+
+router = APIRouter()
+
+
+class RequestIdMiddleware:
+    """
+    Setzt pro Request eine Korrelations-ID (X-Request-ID oder neu erzeugt)
+    fuer die Logs und gibt sie im Response-Header zurueck.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:12]
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append(
+                    (b"x-request-id", request_id.encode("latin-1"))
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+
+
+class CompressionMiddleware:
+    """
+    Handelt gzip/brotli ueber Accept-Encoding aus und komprimiert fertige
+    JSON-Antworten (/api und Dashboard content_only). Gestreamte Antworten
+    (SSE) und bereits kodierte Bodies bleiben unangetastet.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def choose_encoding(accept: str) -> Optional[str]:
+        offered = {}
+        for part in accept.lower().split(","):
+            name, _, q = part.strip().partition(";q=")
+            try:
+                offered[name.strip()] = float(q) if q else 1.0
+            except ValueError:
+                continue
+        if brotli is not None and offered.get("br", 0) > 0:
+            return "br"
+        if offered.get("gzip", 0) > 0:
+            return "gzip"
+        return None
+
+    @staticmethod
+    def with_vary(headers) -> list:
+        """Ergaenzt Accept-Encoding im Vary-Header oder setzt ihn neu."""
+        result, found = [], False
+        for name, value in headers:
+            if name == b"vary":
+                found = True
+                tokens = [t.strip().lower() for t in value.split(b",")]
+                if b"accept-encoding" not in tokens and b"*" not in tokens:
+                    value += b", Accept-Encoding"
+            result.append((name, value))
+        if not found:
+            result.append((b"vary", b"Accept-Encoding"))
+        return result
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = b""
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                accept = value
+                break
+        encoding = self.choose_encoding(accept.decode("latin-1"))
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", ()))
+                content_type = headers.get(b"content-type", b"")
+                if content_type.startswith(b"application/json") and (
+                    b"content-encoding" not in headers
+                ):
+                    # Die Antwort haengt immer vom Accept-Encoding ab, auch
+                    # wenn sie am Ende unkomprimiert rausgeht
+                    message = {
+                        **message,
+                        "headers": self.with_vary(message.get("headers", ())),
+                    }
+                    if encoding is not None:
+                        # Erst den Body abwarten, dann entscheiden
+                        start_message = message
+                        return
+                await send(message)
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            message_start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = [
+                (k, v)
+                for k, v in message_start.get("headers", ())
+                if k != b"content-length"
+            ]
+            if message.get("more_body", False) or len(body) < COMPRESS_MIN_SIZE:
+                await send(message_start)
+                await send(message)
+                return
+            if encoding == "br":
+                body = brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+            else:
+                body = gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ]
+            await send({**message_start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
 templates = Jinja2Templates(directory="templates")
+TEMPLATE_NAMES = (
+    "dashboard.html",
+    "login.html",
+    "torbox_table.html",
+    "altmount_table.html",
+    "backend_status.html",
+)
+
+
+def precompile_templates():
+    """Kompiliert alle Templates vorab in den Jinja-Cache."""
+    for name in TEMPLATE_NAMES:
+        templates.get_template(name)
+
+
+HISTORY_FTS = False
 
 
 def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.cursor()
+    # Autocommit-Modus, damit die Migration explizit als BEGIN IMMEDIATE laeuft
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        # auto_vacuum laesst sich nur vor der ersten Tabelle setzen (neue DB)
+        if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL erlaubt dem Dashboard parallel zu lesen, waehrend der Writer schreibt
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Mehrere Worker migrieren gleichzeitig: der zweite wartet hier und
+        # sieht danach die fertigen Tabellen
+        conn.execute("BEGIN IMMEDIATE")
+        _migrate(conn.cursor())
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _migrate(cursor: sqlite3.Cursor):
+    global HISTORY_FTS
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            info TEXT, time TEXT, mode TEXT, status TEXT
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_history_mode_id ON history (mode, id)"
+    )
+
+    # Zaehler pro Mode, per Trigger gepflegt (kein COUNT(*) pro Refresh)
+    has_counts = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='history_counts'"
+    ).fetchone()
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history_counts (
+            mode TEXT PRIMARY KEY, count INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS history_counts_ai AFTER INSERT ON history
+        BEGIN
+            INSERT INTO history_counts (mode, count) VALUES (new.mode, 1)
+            ON CONFLICT(mode) DO UPDATE SET count = count + 1;
+        END
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS history_counts_ad AFTER DELETE ON history
+        BEGIN
+            UPDATE history_counts SET count = count - 1 WHERE mode = old.mode;
+        END
+    """
+    )
+    if not has_counts:
+        cursor.execute(
+            "INSERT OR IGNORE INTO history_counts (mode, count) "
+            "SELECT mode, COUNT(*) FROM history GROUP BY mode"
+        )
+
+    # Vorab aggregierte Statistik: Zaehler pro Mode und Stunde fuer alle
+    # Requests. Bleibt auch nach Retention/Archivierung vollstaendig, waehrend
+    # history_counts nur die vorhandenen Zeilen (fuer die Seitenzahl) zaehlt.
+    has_hourly = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='history_hourly'"
+    ).fetchone()
+    cursor.execute("DROP TABLE IF EXISTS history_stats")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history_hourly (
+            hour TEXT NOT NULL, mode TEXT NOT NULL, count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, mode)
+        )
+    """
+    )
+    if not has_hourly:
         cursor.execute(
             """
-            CREATE TABLE IF NOT EXISTS history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                info TEXT, time TEXT, mode TEXT, status TEXT
-            )
+            INSERT OR IGNORE INTO history_hourly (hour, mode, count)
+            SELECT substr(time, 1, 13), mode, COUNT(*) FROM history GROUP BY 1, 2
+        """
+        )
+    cursor.execute(
         """
+        CREATE TABLE IF NOT EXISTS history_archive (
+            id INTEGER PRIMARY KEY, info TEXT, time TEXT, mode TEXT, status TEXT
         )
+    """
+    )
+
+    # Trigram-Volltextindex fuer die Suche im Dashboard (falls verfuegbar)
+    try:
+        has_fts = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='history_fts'"
+        ).fetchone()
         cursor.execute(
             """
-            CREATE TABLE IF NOT EXISTS torbox_cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT, progress REAL, state TEXT, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                info, content='history', content_rowid='id', tokenize='trigram'
             )
         """
         )
-        conn.commit()
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history
+            BEGIN
+                INSERT INTO history_fts (rowid, info) VALUES (new.id, new.info);
+            END
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history
+            BEGIN
+                INSERT INTO history_fts (history_fts, rowid, info)
+                VALUES ('delete', old.id, old.info);
+            END
+        """
+        )
+        if not has_fts:
+            cursor.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+        HISTORY_FTS = True
+    except sqlite3.OperationalError as e:
+        db_log.warning("FTS5/Trigram nicht verfuegbar, Suche per LIKE: %s", e)
+        HISTORY_FTS = False
+
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS nzb_hashes (
+            hash TEXT PRIMARY KEY, nzo_ids TEXT, filename TEXT, created_at REAL
+        )
+    """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_nzb_hashes_created ON nzb_hashes (created_at)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dedup_stats (
+            name TEXT PRIMARY KEY, count INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS torbox_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0, stale INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    cursor.execute("INSERT OR IGNORE INTO torbox_meta (id) VALUES (1)")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS poller_lease (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            owner TEXT, expires_at REAL NOT NULL DEFAULT 0
+        )
+    """
+    )
+    cursor.execute("INSERT OR IGNORE INTO poller_lease (id) VALUES (1)")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS torbox_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT, progress REAL, state TEXT, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+
+
+class HistoryWriter:
+    """
+    Schreibt History-Eintraege aus einem eigenen Thread mit einer einzigen,
+    dauerhaften WAL-Verbindung. /api legt Zeilen nur in die Queue; der Thread
+    committet alle HISTORY_FLUSH_MS bzw. HISTORY_BATCH_SIZE Zeilen gebuendelt.
+    """
+
+    _STOP = object()
+    RETRY_DELAY_MIN = 0.5
+    RETRY_DELAY_MAX = 5.0
+    STOP_RETRIES = 3
+
+    def __init__(self, db_path: str, batch_size: int, flush_ms: int):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.queue: "queue.Queue" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        # Hoechste geschriebene ID (gesamt / nur Uploads) fuer Change-Events
+        self.high_water = 0
+        self.upload_high_water = 0
+        self.on_change = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name="history-writer", daemon=True
+            )
+            self.thread.start()
+
+    def enqueue(self, info: str, mode: str, status_code: str = "200"):
+        self.queue.put((info, time.strftime("%Y-%m-%d %H:%M:%S"), mode, status_code))
+
+    def enqueue_many(self, entries: List[tuple]):
+        """(info, mode, status)-Tupel, die in einer Transaktion landen."""
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.queue.put(
+            [(info, now, mode, status_code) for info, mode, status_code in entries]
+        )
+
+    def stop(self):
+        # Sentinel einreihen und warten, bis alle Zeilen geschrieben sind
+        if self.thread is not None:
+            self.queue.put(self._STOP)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        conn = sqlite3.connect(
+            self.db_path, timeout=HISTORY_BUSY_TIMEOUT, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._update_high_water(conn)
+        # Batch, dessen Commit fehlschlug (z.B. DB gesperrt); wird wiederholt
+        pending: List[tuple] = []
+        retry_delay = self.RETRY_DELAY_MIN
+        stopping = False
+        try:
+            while not stopping:
+                try:
+                    item = self.queue.get(timeout=retry_delay if pending else None)
+                except queue.Empty:
+                    item = None
+                if item is self._STOP:
+                    stopping = True
+                    item = None
+                batch = pending
+                if item is not None:
+                    batch.extend(item if isinstance(item, list) else [item])
+                deadline = time.monotonic() + self.flush_interval
+                while not stopping and len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        stopping = True
+                        break
+                    batch.extend(item if isinstance(item, list) else [item])
+                if not batch:
+                    continue
+                if self._write(conn, batch):
+                    pending, retry_delay = [], self.RETRY_DELAY_MIN
+                else:
+                    pending = batch
+                    retry_delay = min(retry_delay * 2, self.RETRY_DELAY_MAX)
+
+            # Beim Stoppen noch ein paar Versuche, dann erst aufgeben
+            for _attempt in range(self.STOP_RETRIES):
+                if not pending or self._write(conn, pending):
+                    pending = []
+                    break
+                time.sleep(self.RETRY_DELAY_MAX)
+            if pending:
+                db_log.error("History: %s Zeilen beim Stoppen verworfen", len(pending))
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[tuple]) -> bool:
+        """Schreibt den Batch; False, wenn er wiederholt werden soll."""
+        # Einzelzeilen nur fuer Uploads (bzw. Polls im Raw-Fenster), Zaehler fuer alle
+        rows = [
+            row for row in batch if row[2] in UPLOAD_MODES or HISTORY_POLL_RAW_HOURS > 0
+        ]
+        hourly: Dict[tuple, int] = {}
+        for _info, row_time, row_mode, _status in batch:
+            key = (row_time[:13], row_mode)
+            hourly[key] = hourly.get(key, 0) + 1
+        try:
+            started = time.perf_counter()
+            with conn:
+                if rows:
+                    conn.executemany(
+                        "INSERT INTO history (info, time, mode, status) "
+                        "VALUES (?, ?, ?, ?)",
+                        rows,
+                    )
+                conn.executemany(
+                    """
+                    INSERT INTO history_hourly (hour, mode, count) VALUES (?, ?, ?)
+                    ON CONFLICT(hour, mode) DO UPDATE SET count = count + excluded.count
+                """,
+                    [(hour, m, n) for (hour, m), n in hourly.items()],
+                )
+            HISTORY_WRITE.labels().observe(time.perf_counter() - started)
+            HISTORY_ROWS.labels().inc(len(rows))
+            self._update_high_water(conn)
+            return True
+        except sqlite3.OperationalError as db_error:
+            # Gesperrt/busy oder I/O: Batch behalten und spaeter erneut schreiben
+            db_log.warning(
+                "DB Fehler (%s Zeilen, neuer Versuch): %s", len(batch), db_error
+            )
+            return False
+        except Exception as db_error:
+            db_log.error("DB Fehler (%s Zeilen verworfen): %s", len(batch), db_error)
+            return True
+
+    def _update_high_water(self, conn: sqlite3.Connection):
+        high_water = conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM history"
+        ).fetchone()[0]
+        upload_high_water = conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM history WHERE mode IN (?, ?)",
+            UPLOAD_MODES,
+        ).fetchone()[0]
+        if (high_water, upload_high_water) == (self.high_water, self.upload_high_water):
+            return
+        self.high_water, self.upload_high_water = high_water, upload_high_water
+        if self.on_change is not None:
+            self.on_change()
+
+    def refresh_high_water(self):
+        # Mehrere Worker schreiben in dieselbe DB; Stand periodisch nachlesen
+        with sqlite3.connect(self.db_path) as conn:
+            self._update_high_water(conn)
+
+
+history_writer = HistoryWriter(DB_PATH, HISTORY_BATCH_SIZE, HISTORY_FLUSH_MS)
+# Zaehlt Wartungslaeufe, die Zeilen entfernt haben (fuer Dashboard-ETags)
+history_maintenance_runs = 0
+
+
+def _local_cutoff(hours: float) -> str:
+    return time.strftime(
+        "%Y-%m-%d %H:%M:%S", time.localtime(time.time() - hours * 3600)
+    )
+
+
+def run_history_maintenance() -> Dict[str, int]:
+    """
+    Retention in kleinen Transaktionen: alte Poll-Zeilen loeschen (die Zaehler
+    stehen bereits in history_hourly), alte Uploads archivieren, danach
+    inkrementelles VACUUM und PRAGMA optimize. Laeuft in einem Thread.
+    """
+    result = {"deleted": 0, "archived": 0, "vacuum_pages": 0}
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        poll_cutoff = _local_cutoff(HISTORY_POLL_RAW_HOURS)
+        while True:
+            with conn:
+                cur = conn.execute(
+                    """
+                    DELETE FROM history WHERE id IN (
+                        SELECT id FROM history WHERE mode NOT IN (?, ?) AND time < ?
+                        ORDER BY id LIMIT ?
+                    )
+                """,
+                    (*UPLOAD_MODES, poll_cutoff, HISTORY_MAINTENANCE_CHUNK),
+                )
+            result["deleted"] += cur.rowcount
+            if cur.rowcount < HISTORY_MAINTENANCE_CHUNK:
+                break
+
+        archive_cutoff = _local_cutoff(HISTORY_ARCHIVE_DAYS * 24)
+        while True:
+            ids = [
+                (row[0],)
+                for row in conn.execute(
+                    "SELECT id FROM history WHERE mode IN (?, ?) AND time < ? "
+                    "ORDER BY id LIMIT ?",
+                    (*UPLOAD_MODES, archive_cutoff, HISTORY_MAINTENANCE_CHUNK),
+                )
+            ]
+            if not ids:
+                break
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO history_archive
+                        (id, info, time, mode, status)
+                    SELECT id, info, time, mode, status FROM history WHERE id = ?
+                """,
+                    ids,
+                )
+                conn.executemany("DELETE FROM history WHERE id = ?", ids)
+            result["archived"] += len(ids)
+            if len(ids) < HISTORY_MAINTENANCE_CHUNK:
+                break
+
+        # Nur DBs, die init_db neu mit auto_vacuum=INCREMENTAL angelegt hat;
+        # ein volles VACUUM wuerde den Writer zu lange blockieren
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            result["vacuum_pages"] = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute(f"PRAGMA incremental_vacuum({HISTORY_VACUUM_PAGES})")
+        conn.execute("PRAGMA optimize")
+    return result
+
+
+def holds_poller_lease(owner: str) -> bool:
+    with sqlite3.connect(DB_PATH) as conn:
+        row = conn.execute(
+            "SELECT owner, expires_at FROM poller_lease WHERE id = 1"
+        ).fetchone()
+    return bool(row) and row[0] == owner and row[1] >= time.time()
+
+
+class HistoryStatsCache:
+    """
+    Per-Mode-Summen fuer das Dashboard. Werden hoechstens alle
+    HISTORY_STATS_INTERVAL Sekunden neu gelesen (sofort nach Uploads oder
+    Wartung), damit *arr-Polls nicht bei jedem Refresh den ETag aendern.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self.version = 0
+        self.loaded_at = float("-inf")
+        self.source = None
+
+    def get(self) -> tuple:
+        source = (history_writer.upload_high_water, history_maintenance_runs)
+        now = time.monotonic()
+        if source != self.source or now - self.loaded_at >= self.interval:
+            with sqlite3.connect(DB_PATH) as conn:
+                counts = read_history_stats(conn)
+            self.loaded_at, self.source = now, source
+            if counts != self.counts:
+                self.counts = counts
+                self.version += 1
+        return self.version, self.counts
+
+
+def read_history_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Gesamtzahl aller Requests pro Mode aus den Stundenzaehlern."""
+    return dict(
+        conn.execute(
+            "SELECT mode, SUM(count) FROM history_hourly GROUP BY mode"
+        ).fetchall()
+    )
+
+
+history_stats_cache = HistoryStatsCache(HISTORY_STATS_INTERVAL)
+
+
+class DashboardEvents:
+    """
+    Weckt wartende SSE-Streams auf, sobald sich TorBox-Snapshot oder
+    History geaendert haben. Der eigentliche Zustand wird in state() gelesen.
+    """
+
+    def __init__(self):
+        self.event = asyncio.Event()
+
+    def notify(self):
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @staticmethod
+    def state() -> Dict[str, Any]:
+        return {
+            "torbox": torbox_snapshot.version if torbox_snapshot else 0,
+            "stale": torbox_stale,
+            "history": history_writer.high_water,
+            "uploads": history_writer.upload_high_water,
+            "backends": backend_pool.health_version,
+            "maintenance": history_maintenance_runs,
+            "imports": import_progress.summary(),
+        }
+
+
+dashboard_events = DashboardEvents()
+
+
+class ImportProgress:
+    """Fortschritt laufender Bulk-Importe; wird per SSE ans Dashboard gepusht."""
+
+    def __init__(self):
+        self.jobs: Dict[int, Dict[str, int]] = {}
+        self.seq = 0
+
+    def start(self, total: int) -> int:
+        self.seq += 1
+        self.jobs[self.seq] = {"total": total, "done": 0, "failed": 0, "duplicates": 0}
+        dashboard_events.notify()
+        return self.seq
 
+    def advance(self, job: int, status_code: str):
+        entry = self.jobs[job]
+        entry["done"] += 1
+        if status_code == "DUP":
+            entry["duplicates"] += 1
+        elif status_code != "200":
+            entry["failed"] += 1
+        dashboard_events.notify()
 
-init_db()
+    def finish(self, job: int):
+        self.jobs.pop(job, None)
+        dashboard_events.notify()
+
+    def summary(self) -> tuple:
+        """(fertig, gesamt, fehlgeschlagen) ueber alle laufenden Importe."""
+        if not self.jobs:
+            return ()
+        return tuple(
+            sum(entry[key] for entry in self.jobs.values())
+            for key in ("done", "total", "failed")
+        )
+
+
+import_progress = ImportProgress()
+
+
+class FragmentCache:
+    """
+    LRU-Cache fuer die gerenderten content_only-Antworten des Dashboards.
+    Der Schluessel enthaelt alle Parameter und Datenversionen, daher ist
+    keine explizite Invalidierung noetig.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+    @staticmethod
+    def etag(key: tuple) -> str:
+        digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=12)
+        return f'W/"{digest.hexdigest()}"'
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        body = self.entries.get(key)
+        if body is not None:
+            self.entries.move_to_end(key)
+        return body
+
+    def put(self, key: tuple, body: bytes):
+        self.entries[key] = body
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_SIZE)
+
+
+def query_history(
+    conn: sqlite3.Connection,
+    filter_active: int,
+    search_h: str,
+    page_h: int,
+    before_h: int = 0,
+    after_h: int = 0,
+):
+    """
+    Liefert (Zeilen, Gesamtanzahl) fuer die Altmount-Tabelle.
+    Mit before_h/after_h wird per Keyset (id) statt per OFFSET geblaettert.
+    """
+    where, params = [], []
+    if filter_active:
+        where.append("mode IN (?, ?)")
+        params.extend(UPLOAD_MODES)
+    search = search_h.strip()
+    if search:
+        if HISTORY_FTS and len(search) >= 3:
+            # Trigram-MATCH entspricht LIKE '%x%' (case-insensitive)
+            where.append(
+                "id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)"
+            )
+            params.append('"' + search.replace('"', '""') + '"')
+        else:
+            where.append("info LIKE ?")
+            params.append(f"%{search}%")
+
+    if search:
+        total = conn.execute(
+            "SELECT COUNT(*) FROM history WHERE " + " AND ".join(where), params
+        ).fetchone()[0]
+    elif filter_active:
+        total = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM history_counts WHERE mode IN (?, ?)",
+            UPLOAD_MODES,
+        ).fetchone()[0]
+    else:
+        total = conn.execute(
+            "SELECT COALESCE(SUM(count), 0) FROM history_counts"
+        ).fetchone()[0]
+
+    if before_h > 0:
+        clause = " AND ".join(where + ["id < ?"])
+        rows = conn.execute(
+            f"SELECT * FROM history WHERE {clause} ORDER BY id DESC LIMIT ?",
+            (*params, before_h, ITEMS_PER_PAGE),
+        ).fetchall()
+    elif after_h > 0:
+        clause = " AND ".join(where + ["id > ?"])
+        rows = conn.execute(
+            f"SELECT * FROM history WHERE {clause} ORDER BY id ASC LIMIT ?",
+            (*params, after_h, ITEMS_PER_PAGE),
+        ).fetchall()[::-1]
+    else:
+        clause = " AND ".join(where) or "1=1"
+        rows = conn.execute(
+            f"SELECT * FROM history WHERE {clause} ORDER BY id DESC LIMIT ? OFFSET ?",
+            (*params, ITEMS_PER_PAGE, (page_h - 1) * ITEMS_PER_PAGE),
+        ).fetchall()
+    return [dict(row) for row in rows], total
 
 
 def get_current_user(request: Request):
     return request.cookies.get("user")
 
 
-async def fetch_torbox_to_db():
-    global torbox_memory_cache, last_api_fetch
+def torbox_item_is_active(item: Dict) -> bool:
+    st = item["state"]
+    if st in TORBOX_DONE_STATES or "FAILED" in st or "ERROR" in st or "ABORTED" in st:
+        return False
+    return True
+
+
+class TorboxSnapshot:
+    """
+    Unveraenderlicher Stand der TorBox-Liste, vom Poller veroeffentlicht.
+    Haelt vorberechnete Kleinschreibung, einen Trigram-Index fuer die
+    Teilstring-Suche und eine monoton steigende Versionsnummer.
+    """
+
+    __slots__ = ("items", "names_lower", "version", "active", "_trigrams", "_results")
+
+    def __init__(self, items: List[Dict], version: int):
+        # Stabile Reihenfolge: neueste TorBox-ID zuerst
+        self.items = tuple(sorted(items, key=lambda i: -i.get("id", 0)))
+        self.names_lower = tuple(i["name"].lower() for i in self.items)
+        self.version = version
+        self.active = any(torbox_item_is_active(i) for i in self.items)
+        trigrams: Dict[str, List[int]] = {}
+        for idx, name in enumerate(self.names_lower):
+            for gram in {name[p : p + 3] for p in range(len(name) - 2)}:
+                trigrams.setdefault(gram, []).append(idx)
+        self._trigrams = trigrams
+        self._results: Dict[str, tuple] = {}
+
+    def search(self, term: str) -> tuple:
+        term = term.lower().strip()
+        if not term:
+            return self.items
+        hit = self._results.get(term)
+        if hit is not None:
+            return hit
+
+        if len(term) >= 3:
+            # Kandidaten ueber die kleinste Posting-Liste, danach exakt pruefen
+            postings = [
+                self._trigrams.get(term[p : p + 3], ()) for p in range(len(term) - 2)
+            ]
+            candidates = min(postings, key=len)
+        else:
+            candidates = range(len(self.items))
+        result = tuple(
+            self.items[idx] for idx in candidates if term in self.names_lower[idx]
+        )
+
+        if len(self._results) >= 128:
+            self._results.clear()
+        self._results[term] = result
+        return result
+
+    def page(self, term: str, page: int) -> tuple:
+        """Liefert (Eintraege der Seite, Seitenanzahl)."""
+        matches = self.search(term)
+        total_pages = max(1, math.ceil(len(matches) / ITEMS_PER_PAGE))
+        return matches[(page - 1) * ITEMS_PER_PAGE : page * ITEMS_PER_PAGE], total_pages
+
+
+def sync_torbox_rows(new_rows: Dict[int, tuple]) -> tuple:
+    """
+    Gleicht torbox_cache per Diff an: nur geaenderte IDs werden per Upsert
+    geschrieben, verschwundene geloescht - alles in einer Transaktion.
+    Bei Aenderungen wird torbox_meta.version erhoeht; zurueck kommen
+    (geaendert, entfernt, Version).
+    """
+    global torbox_db_rows
+    with sqlite3.connect(DB_PATH) as conn:
+        if torbox_db_rows is None:
+            torbox_db_rows = {
+                row[0]: (row[1], row[2], row[3])
+                for row in conn.execute(
+                    "SELECT id, name, progress, state FROM torbox_cache"
+                )
+            }
+        changed = [
+            (tid, *row)
+            for tid, row in new_rows.items()
+            if torbox_db_rows.get(tid) != row
+        ]
+        removed = [(tid,) for tid in torbox_db_rows if tid not in new_rows]
+        if changed:
+            conn.executemany(
+                """
+                INSERT INTO torbox_cache (id, name, progress, state) VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET name = excluded.name,
+                    progress = excluded.progress, state = excluded.state,
+                    updated_at = CURRENT_TIMESTAMP
+            """,
+                changed,
+            )
+        if removed:
+            conn.executemany("DELETE FROM torbox_cache WHERE id = ?", removed)
+        if changed or removed:
+            conn.execute("UPDATE torbox_meta SET version = version + 1 WHERE id = 1")
+        version = conn.execute(
+            "SELECT version FROM torbox_meta WHERE id = 1"
+        ).fetchone()[0]
+        conn.commit()
+    torbox_db_rows = new_rows
+    return len(changed), len(removed), version
+
+
+def write_shared_stale(stale: bool):
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.execute("UPDATE torbox_meta SET stale = ? WHERE id = 1", (int(stale),))
+
+
+def load_shared_torbox(current_version: int) -> Optional[tuple]:
+    """
+    Liest den vom Poller veroeffentlichten Stand. Die Zeilen werden nur
+    geladen, wenn sich die Version geaendert hat: (Version, stale, Items|None).
+    """
+    with sqlite3.connect(DB_PATH) as conn:
+        version, stale = conn.execute(
+            "SELECT version, stale FROM torbox_meta WHERE id = 1"
+        ).fetchone()
+        items = None
+        if version != current_version:
+            items = [
+                {"id": row[0], "name": row[1], "progress": row[2], "state": row[3]}
+                for row in conn.execute(
+                    "SELECT id, name, progress, state FROM torbox_cache"
+                )
+            ]
+    return version, bool(stale), items
+
+
+def acquire_poller_lease(owner: str) -> bool:
+    """Erneuert bzw. uebernimmt die Poller-Lease (abgelaufen oder eigene)."""
+    now = time.time()
+    with sqlite3.connect(DB_PATH) as conn:
+        cur = conn.execute(
+            """
+            UPDATE poller_lease SET owner = ?, expires_at = ?
+            WHERE id = 1 AND (owner = ? OR owner IS NULL OR expires_at < ?)
+        """,
+            (owner, now + TORBOX_LEASE_TTL, owner, now),
+        )
+        return cur.rowcount == 1
+
+
+def release_poller_lease(owner: str):
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.execute(
+            "UPDATE poller_lease SET expires_at = 0 WHERE id = 1 AND owner = ?",
+            (owner,),
+        )
+
+
+async def fetch_torbox_to_db() -> bool:
+    """
+    Holt die TorBox-Liste und synchronisiert Speicher-Cache und DB.
+    Bei Fehlern bleibt der letzte gute Stand erhalten und wird als stale markiert.
+    """
     async with cache_lock:
+        before = (torbox_snapshot, torbox_stale)
+        started = time.perf_counter()
+        success = await _fetch_torbox()
+        TORBOX_FETCH.labels().observe(time.perf_counter() - started)
+        if torbox_stale != before[1]:
+            await asyncio.to_thread(write_shared_stale, torbox_stale)
+        if torbox_snapshot is not None:
+            TORBOX_ITEMS.labels().set(len(torbox_snapshot.items))
+        if (torbox_snapshot, torbox_stale) != before:
+            dashboard_events.notify()
+        return success
+
+
+async def _fetch_torbox() -> bool:
+    global torbox_snapshot, last_api_fetch, torbox_stale
+    try:
+        async with httpx.AsyncClient() as client:
+            resp = await client.get(
+                TORBOX_API_URL,
+                headers={"Authorization": f"Bearer {TORBOX_API_KEY}"},
+                timeout=5.0,
+            )
+        if resp.status_code != 200:
+            torbox_log.warning("API antwortete mit Status: %s", resp.status_code)
+            torbox_stale = True
+            return False
+
+        api_data = resp.json().get("data", []) or []
+        new_cache = []
+        new_rows: Dict[int, tuple] = {}
+        for item in api_data:
+            name = item.get("name", "Unbekannt")
+            prog = round(float(item.get("progress", 0)) * 100, 1)
+            st = item.get("download_state", "unknown").replace("_", " ").upper()
+            tid = item.get("id")
+            if not isinstance(tid, int):
+                # Ohne TorBox-ID: stabilen Schluessel aus dem Namen ableiten
+                tid = -zlib.crc32(name.encode("utf-8")) - 1
+            new_rows[tid] = (name, prog, st)
+            new_cache.append({"id": tid, "name": name, "progress": prog, "state": st})
+
+        changed, removed, version = await asyncio.to_thread(sync_torbox_rows, new_rows)
+        if changed or removed:
+            torbox_log.debug("Sync: %s geaendert, %s entfernt", changed, removed)
+        # Neue Version nur bei tatsaechlichen Aenderungen veroeffentlichen
+        if torbox_snapshot is None or torbox_snapshot.version != version:
+            torbox_snapshot = TorboxSnapshot(new_cache, version)
+        torbox_stale = False
+        last_api_fetch = time.time()
+        return True
+    except Exception as e:
+        torbox_log.warning("Abfrage fehlgeschlagen: %s", e)
+        torbox_stale = True
+        return False
+
+
+def next_torbox_interval(success: bool) -> float:
+    """Adaptives Intervall inkl. exponentiellem Backoff bei Fehlern."""
+    global torbox_error_streak
+    if not success:
+        torbox_error_streak += 1
+        TORBOX_ERROR_STREAK.labels().set(torbox_error_streak)
+        return min(
+            TORBOX_POLL_MAX_BACKOFF,
+            TORBOX_POLL_ACTIVE * (2 ** min(torbox_error_streak, 16)),
+        )
+    torbox_error_streak = 0
+    TORBOX_ERROR_STREAK.labels().set(0)
+    if torbox_snapshot is not None and torbox_snapshot.active:
+        return TORBOX_POLL_ACTIVE
+    return TORBOX_POLL_IDLE
+
+
+def lookup_nzb_hash(digest: str) -> Optional[List[str]]:
+    """
+    Sucht einen Hash im Dedup-Fenster und zaehlt Treffer/Fehlschlag.
+    Gibt die urspruenglichen nzo_ids zurueck oder None.
+    """
+    cutoff = time.time() - NZB_DEDUP_WINDOW_HOURS * 3600
+    with sqlite3.connect(DB_PATH) as conn:
+        row = conn.execute(
+            "SELECT nzo_ids FROM nzb_hashes WHERE hash = ? AND created_at >= ?",
+            (digest, cutoff),
+        ).fetchone()
+        conn.execute(
+            """
+            INSERT INTO dedup_stats (name, count) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET count = count + 1
+        """,
+            ("hit" if row else "miss",),
+        )
+    return json.loads(row[0]) if row else None
+
+
+def store_nzb_hash(digest: str, nzo_ids: List[str], filename: str):
+    store_nzb_hashes([(digest, nzo_ids, filename)])
+
+
+def store_nzb_hashes(entries: List[tuple]):
+    """(hash, nzo_ids, filename)-Tupel in einer Transaktion speichern."""
+    now = time.time()
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO nzb_hashes (hash, nzo_ids, filename, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (digest, json.dumps(ids), filename, now)
+                for digest, ids, filename in entries
+            ],
+        )
+        # Alte Hashes gleich mit aufraeumen (Index auf created_at)
+        conn.execute(
+            "DELETE FROM nzb_hashes WHERE created_at < ?",
+            (now - NZB_DEDUP_WINDOW_HOURS * 3600,),
+        )
+
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+async def spool_upload_to_blackhole(upload_obj, file_path: str):
+    """
+    Schreibt den Upload chunkweise (ausserhalb des Event-Loops) in eine
+    temporaere Datei im Blackhole und berechnet dabei den SHA-256. Ist der
+    Hash im Dedup-Fenster schon bekannt, wird die Datei verworfen; sonst wird
+    sie atomar umbenannt, damit der Blackhole-Watcher nie eine halbe .nzb sieht.
+    Gibt (File-Handle auf Position 0 oder None, Groesse, Hash, nzo_ids des
+    Duplikats oder None) zurueck; das Handle wird fuer Altmount gestreamt.
+    """
+    tmp_path = os.path.join(
+        os.path.dirname(file_path),
+        f".{os.path.basename(file_path)}.{os.getpid()}.{time.monotonic_ns()}.part",
+    )
+    buffer = await asyncio.to_thread(open, tmp_path, "w+b")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        await upload_obj.seek(0)
+        while True:
+            chunk = await upload_obj.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await asyncio.to_thread(_write_chunk, buffer, digest, chunk)
+            size += len(chunk)
+        await asyncio.to_thread(buffer.flush)
+        hexdigest = digest.hexdigest()
+
+        if NZB_DEDUP_WINDOW_HOURS > 0:
+            duplicate = await asyncio.to_thread(lookup_nzb_hash, hexdigest)
+            if duplicate is not None:
+                buffer.close()
+                await asyncio.to_thread(os.remove, tmp_path)
+                return None, size, hexdigest, duplicate
+
+        await asyncio.to_thread(os.replace, tmp_path, file_path)
+        buffer.seek(0)
+        return buffer, size, hexdigest, None
+    except BaseException:
+        buffer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class BackendReply:
+    """
+    Rohe Altmount-Antwort (Bytes + Content-Type). Wird unveraendert an den
+    Client durchgereicht; JSON wird nur geparst, wenn der Proxy es braucht.
+    """
+
+    __slots__ = ("body", "content_type", "_parsed")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self._parsed = None
+
+    def json(self) -> Any:
+        if self._parsed is None:
+            self._parsed = json.loads(self.body)
+        return self._parsed
+
+    def to_response(self) -> Response:
+        return Response(self.body, media_type=self.content_type)
+
+
+async def forward_to_backend(
+    mode: Optional[str],
+    params: Dict[str, str],
+    data: Optional[Dict[str, str]] = None,
+    files: Optional[Dict[str, Any]] = None,
+) -> Optional[BackendReply]:
+    """
+    Leitet die Anfrage an Altmount weiter (POST wenn `data` gesetzt, sonst GET).
+    Read-only Modes gehen an das am wenigsten belastete Backend, Uploads
+    (UPLOAD_MODES, auch addurl per GET) an den Primary; bei Fehlern wird das
+    naechste Backend versucht.
+    Gibt die BackendReply zurueck oder None, wenn der Fallback greifen soll.
+    """
+    if backend_client is None:
+        return None
+    if mode in UPLOAD_MODES:
+        candidates = backend_pool.upload_candidates()
+    else:
+        candidates = backend_pool.read_candidates()
+
+    attempts = 0
+    for backend in candidates:
+        if attempts >= BACKEND_MAX_ATTEMPTS:
+            break
+        if not backend.breaker.allow():
+            continue
+        attempts += 1
+        if files:
+            # Beim Failover die gestreamte NZB von vorne senden
+            for value in files.values():
+                if hasattr(value[1], "seek"):
+                    value[1].seek(0)
+        result, retry = await _forward_once(backend, mode, params, data, files)
+        if not retry:
+            return result
+
+    if attempts == 0:
+        api_log.debug("Kein Backend verfuegbar - liefere Fallback")
+    return None
+
+
+async def _forward_once(
+    backend: Backend,
+    mode: Optional[str],
+    params: Dict[str, str],
+    data: Optional[Dict[str, str]],
+    files: Optional[Dict[str, Any]],
+) -> tuple:
+    """Ein Versuch gegen ein Backend: (BackendReply oder None, erneut versuchen?)."""
+    method = "POST" if data is not None else "GET"
+    backend.outstanding += 1
+    backend.requests += 1
+    started = time.perf_counter()
+    try:
+        timeout = get_backend_timeout(mode)
+        if data is not None:
+            altmount_resp = await backend_client.post(
+                backend.url, params=params, data=data, files=files, timeout=timeout
+            )
+        else:
+            altmount_resp = await backend_client.get(
+                backend.url, params=params, timeout=timeout
+            )
+        elapsed = time.perf_counter() - started
+        backend.observe(elapsed)
+        BACKEND_LATENCY.labels(backend.url, method).observe(elapsed)
+        BACKEND_RESPONSES.labels(backend.url, str(altmount_resp.status_code)).inc()
+
+        if altmount_resp.status_code == 200:
+            backend.breaker.record_success()
+            api_log.debug("Weiterleitung an %s erfolgreich", backend.url)
+            reply = BackendReply(
+                altmount_resp.content,
+                altmount_resp.headers.get("content-type", "application/json"),
+            )
+            return reply, False
+
+        api_log.warning(
+            "%s antwortete mit Status: %s", backend.url, altmount_resp.status_code
+        )
+        if altmount_resp.status_code >= 500:
+            backend.failures += 1
+            backend.breaker.record_failure()
+            return None, True
+        backend.breaker.record_success()
+        return None, False
+
+    except Exception as e:
+        BACKEND_LATENCY.labels(backend.url, method).observe(
+            time.perf_counter() - started
+        )
+        BACKEND_RESPONSES.labels(backend.url, "error").inc()
+        backend.failures += 1
+        backend.breaker.record_failure()
+        api_log.warning("Weiterleitung zu %s fehlgeschlagen: %s", backend.url, e)
+        return None, True
+    finally:
+        backend.outstanding -= 1
+
+
+def backend_nzo_ids(result: Optional[BackendReply]) -> Optional[List[str]]:
+    """nzo_ids aus der Altmount-Antwort; None bei Fallback oder ohne IDs."""
+    if result is None:
+        return None
+    try:
+        payload = result.json()
+    except ValueError:
+        return None
+    if isinstance(payload, dict) and payload.get("nzo_ids"):
+        return payload["nzo_ids"]
+    return None
+
+
+def clean_nzb_name(raw_filename: str) -> str:
+    # Nur der Dateiname: "../" oder Windows-Pfade duerfen nicht aus dem
+    # Blackhole heraus schreiben
+    final_name = os.path.basename(raw_filename.replace("\\", "/"))
+    final_name = re.sub(r'["\']', "", final_name.strip())
+    if final_name in ("", ".", ".."):
+        final_name = "Unknown NZB"
+    if not final_name.lower().endswith(".nzb"):
+        final_name += ".nzb"
+    return final_name
+
+
+async def ingest_nzb(
+    upload_obj, final_name: str, mode: str, params: Dict[str, str], data: Dict[str, str]
+) -> Dict[str, Any]:
+    """
+    Eine NZB eines Bulk-Imports: ins Blackhole spoolen, Dedup pruefen und an
+    Altmount weiterleiten. History und Dedup-Hashes schreibt der Aufrufer
+    gesammelt fuer den ganzen Import.
+    """
+    file_path = os.path.join(BLACKHOLE_DIR, final_name)
+    nzb_file, digest = None, None
+    try:
+        nzb_file, size, digest, duplicate_ids = await spool_upload_to_blackhole(
+            upload_obj, file_path
+        )
+        UPLOAD_BYTES.labels().observe(size)
+    except Exception as copy_error:
+        api_log.error("Kopierfehler (%s): %s", final_name, copy_error)
+        duplicate_ids = None
+        await upload_obj.seek(0)
+        nzb_file = upload_obj.file
+    if duplicate_ids is not None:
+        return {"name": final_name, "status": "DUP", "nzo_ids": duplicate_ids}
+
+    try:
+        result = await forward_to_backend(
+            mode,
+            params,
+            data=data,
+            files={"nzbfile": (final_name, nzb_file, "application/x-nzb")},
+        )
+    finally:
+        nzb_file.close()
+    nzo_ids = backend_nzo_ids(result)
+    if not nzo_ids:
+        # Fallback: kein Dedup-Hash, sonst landet der Retry nie bei Altmount
+        return {"name": final_name, "status": "200", "nzo_ids": ["proxy_added"]}
+    return {"name": final_name, "status": "200", "nzo_ids": nzo_ids, "hash": digest}
+
+
+async def ingest_bulk(
+    uploads: List[tuple], mode: str, params: Dict[str, str], data: Dict[str, str]
+) -> Dict[str, Any]:
+    """
+    Verarbeitet mehrere NZBs ((Dateiname, Upload oder Opener)-Paare)
+    parallel mit hoechstens IMPORT_CONCURRENCY gleichzeitigen Altmount-Calls.
+    History und Dedup-Hashes werden danach in je einer Transaktion geschrieben.
+    """
+    started = time.perf_counter()
+    job = import_progress.start(len(uploads))
+    limiter = asyncio.Semaphore(IMPORT_CONCURRENCY)
+
+    async def run_one(raw_filename: str, upload_obj) -> Dict[str, Any]:
+        final_name = clean_nzb_name(raw_filename)
+        entry = {"name": final_name, "status": "ERR", "nzo_ids": []}
+        async with limiter:
+            handle = None
+            try:
+                if callable(upload_obj):
+                    # Archiv/Verzeichnis: Quelle erst oeffnen, wenn sie dran ist,
+                    # und wie bei addfile chunkweise spoolen
+                    handle = await asyncio.to_thread(upload_obj)
+                    upload_obj = UploadFile(handle, filename=final_name)
+                entry = await ingest_nzb(upload_obj, final_name, mode, params, data)
+            except Exception as e:
+                api_log.error("Import von %s fehlgeschlagen: %s", final_name, e)
+                entry["error"] = str(e)
+            finally:
+                if handle is not None:
+                    handle.close()
+                import_progress.advance(job, entry["status"])
+        return entry
+
+    try:
+        results = await asyncio.gather(
+            *(run_one(name, upload_obj) for name, upload_obj in uploads)
+        )
+    finally:
+        import_progress.finish(job)
+
+    history_writer.enqueue_many([(r["name"], mode, r["status"]) for r in results])
+    hashes = [(r["hash"], r["nzo_ids"], r["name"]) for r in results if r.get("hash")]
+    for r in results:
+        r.pop("hash", None)
+    if hashes:
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(
-                    "https://api.torbox.app/v1/api/usenet/mylist",
-                    headers={"Authorization": f"Bearer {TORBOX_API_KEY}"},
-                    timeout=5.0,
+            await asyncio.to_thread(store_nzb_hashes, hashes)
+        except Exception as e:
+            db_log.error("Dedup-Hashes nicht gespeichert: %s", e)
+    response_cache.invalidate()
+
+    counts = {"ok": 0, "duplicates": 0, "failed": 0}
+    for r in results:
+        key = {"200": "ok", "DUP": "duplicates"}.get(r["status"], "failed")
+        counts[key] += 1
+    elapsed = time.perf_counter() - started
+    api_log.info("Bulk-Import: %s Dateien in %.1fs (%s)", len(results), elapsed, counts)
+    return {
+        "status": True,
+        "nzo_ids": [nzo_id for r in results for nzo_id in r["nzo_ids"]],
+        "files": results,
+        **counts,
+        "elapsed": round(elapsed, 3),
+    }
+
+
+def open_zip_member(archive_path: str, member: str):
+    """Oeffnet ein einzelnes Zip-Member als Stream (eigenes Handle pro Aufruf)."""
+    archive = zipfile.ZipFile(archive_path)
+    try:
+        return archive.open(member)
+    finally:
+        # Das Member haelt die Datei offen, bis es selbst geschlossen wird
+        archive.close()
+
+
+def prepare_nzb_archive(fileobj, archive_name: str, workdir: str) -> List[tuple]:
+    """
+    Kopiert das hochgeladene Archiv chunkweise nach `workdir` und liefert
+    (Dateiname, Opener)-Paare fuer alle .nzb (blockierend). Zip-Member werden
+    erst beim Import einzeln geoeffnet; tar(.gz) erlaubt keinen guenstigen
+    wahlfreien Zugriff und wird deshalb in einem Durchgang nach `workdir`
+    entpackt. Der Speicherbedarf bleibt in beiden Faellen bei UPLOAD_CHUNK_SIZE.
+    """
+    archive_path = os.path.join(workdir, "archive")
+    fileobj.seek(0)
+    with open(archive_path, "wb") as out:
+        shutil.copyfileobj(fileobj, out, UPLOAD_CHUNK_SIZE)
+
+    members: List[tuple] = []
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(".nzb"):
+                    continue
+                if info.file_size > IMPORT_MAX_FILE_SIZE:
+                    raise ValueError(f"{info.filename} ist zu gross")
+                members.append(
+                    (
+                        info.filename,
+                        functools.partial(open_zip_member, archive_path, info.filename),
+                    )
                 )
-                if resp.status_code == 200:
-                    api_data = resp.json().get("data", [])
-                    new_cache = []
-                    with sqlite3.connect(DB_PATH) as conn:
-                        cursor = conn.cursor()
-                        cursor.execute("DELETE FROM torbox_cache")
-                        for item in api_data:
-                            name = item.get("name", "Unbekannt")
-                            prog = round(float(item.get("progress", 0)) * 100, 1)
-                            st = (
-                                item.get("download_state", "unknown")
-                                .replace("_", " ")
-                                .upper()
-                            )
-                            cursor.execute(
-                                "INSERT INTO torbox_cache (name, progress, state) VALUES (?, ?, ?)",
-                                (name, prog, st),
-                            )
-                            new_cache.append(
-                                {"name": name, "progress": prog, "state": st}
-                            )
-                        conn.commit()
-                    torbox_memory_cache = new_cache
-                    last_api_fetch = time.time()
-                else:
-                    torbox_memory_cache = []  # Leeren wenn API Fehler
-        except Exception:
-            torbox_memory_cache = []  # Leeren wenn API nicht erreichbar
+                if len(members) > IMPORT_MAX_FILES:
+                    raise ValueError(f"Mehr als {IMPORT_MAX_FILES} NZBs")
+        return members
+
+    try:
+        archive = tarfile.open(archive_path, mode="r|*")
+    except tarfile.TarError:
+        raise ValueError(f"{archive_name} ist weder zip noch tar")
+    with archive:
+        for info in archive:
+            if not info.isfile() or not info.name.lower().endswith(".nzb"):
+                continue
+            if info.size > IMPORT_MAX_FILE_SIZE:
+                raise ValueError(f"{info.name} ist zu gross")
+            if len(members) >= IMPORT_MAX_FILES:
+                raise ValueError(f"Mehr als {IMPORT_MAX_FILES} NZBs")
+            member_path = os.path.join(workdir, f"{len(members):05d}.nzb")
+            with open(member_path, "wb") as out:
+                shutil.copyfileobj(archive.extractfile(info), out, UPLOAD_CHUNK_SIZE)
+            members.append((info.name, functools.partial(open, member_path, "rb")))
+    os.remove(archive_path)
+    return members
+
+
+def scan_import_dir(directory: str) -> List[str]:
+    """Alle .nzb unterhalb von IMPORT_DIR/<directory> (blockierend)."""
+    root = os.path.realpath(IMPORT_DIR)
+    target = os.path.realpath(os.path.join(root, directory))
+    if target != root and not target.startswith(root + os.sep):
+        raise ValueError("Verzeichnis liegt ausserhalb von IMPORT_DIR")
+    if not os.path.isdir(target):
+        raise ValueError(f"Verzeichnis nicht gefunden: {directory}")
+    paths = []
+    for dirpath, _dirnames, filenames in os.walk(target):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(".nzb"):
+                paths.append(os.path.join(dirpath, filename))
+    if len(paths) > IMPORT_MAX_FILES:
+        raise ValueError(f"Mehr als {IMPORT_MAX_FILES} NZBs")
+    return paths
 
 
 # --- SABNZBD API (FORCE COPY & CLEAN NAME) ---
-@app.api_route("/api", methods=["GET", "POST"])
+@router.api_route("/api", methods=["GET", "POST"])
 async def sabnzbd_api(request: Request):
-    print(f"\n{'='*60}")
-    print(f"[API] Neue Anfrage: {request.method}")
+    started = time.perf_counter()
+    request.state.outcome = "error"
+    try:
+        return await handle_sabnzbd_request(request)
+    finally:
+        API_LATENCY.labels(
+            mode_label(request.query_params.get("mode")), request.state.outcome
+        ).observe(time.perf_counter() - started)
+
 
+async def handle_sabnzbd_request(request: Request):
     params = dict(request.query_params)
     mode = params.get("mode")
     final_name = "Unknown NZB"
+    nzb_file = None
+    nzb_digest = None
+    duplicate_ids = None
+    form_data: Dict[str, Any] = {}
 
-    print(f"[API] Query Params: {params}")
-    print(f"[API] Mode: {mode}")
+    api_log.debug("%s mode=%s", request.method, mode)
+    api_log.debug("Query Params: %s", redact(params))
 
     if request.method == "POST":
         try:
             form_data = await request.form()
-            print(f"[API] Form Keys: {list(form_data.keys())}")
-
-            # Debug: Zeige alle Form-Felder
-            for key in form_data:
-                value = form_data[key]
-                # Prüfe auf UploadFile-Attribute statt isinstance
-                if hasattr(value, "filename") and hasattr(value, "read"):
-                    print(
-                        f"[API] Field '{key}': UploadFile(filename='{value.filename}', size={getattr(value, 'size', 'unknown')})"
-                    )
-                else:
-                    print(f"[API] Field '{key}': {type(value).__name__} = '{value}'")
+            # Debug: Zeige alle Form-Felder (nur bei LOG_LEVEL=DEBUG)
+            if api_log.isEnabledFor(logging.DEBUG):
+                for key, value in redact(dict(form_data)).items():
+                    # Prüfe auf UploadFile-Attribute statt isinstance
+                    if hasattr(value, "filename") and hasattr(value, "read"):
+                        api_log.debug(
+                            "Field '%s': UploadFile(filename='%s', size=%s)",
+                            key,
+                            value.filename,
+                            getattr(value, "size", "unknown"),
+                        )
+                    else:
+                        api_log.debug(
+                            "Field '%s': %s = '%s'", key, type(value).__name__, value
+                        )
+
+            # Mehrere NZB-Parts in einem addfile: parallel als Bulk verarbeiten
+            uploads = [
+                (value.filename, value)
+                for _key, value in form_data.multi_items()
+                if hasattr(value, "filename")
+                and hasattr(value, "read")
+                and value.filename
+            ]
+            if mode == "addfile" and len(uploads) > 1:
+                request.state.outcome = "bulk"
+                string_fields = {
+                    key: value
+                    for key, value in form_data.items()
+                    if isinstance(value, str)
+                }
+                return JSONResponse(
+                    await ingest_bulk(uploads, mode, params, string_fields)
+                )
 
             # Suche nach Upload-Datei - prüfe gängige Feldnamen
             upload_obj = None
@@ -179,7 +2184,7 @@ async def sabnzbd_api(request: Request):
                     # Prüfe auf UploadFile-Attribute statt isinstance
                     if hasattr(value, "filename") and hasattr(value, "read"):
                         upload_obj = value
-                        print(f"[API] Upload gefunden in Feld: '{field_name}'")
+                        api_log.debug("Upload gefunden in Feld: '%s'", field_name)
                         break
 
             # Fallback: Suche in allen Feldern
@@ -189,57 +2194,53 @@ async def sabnzbd_api(request: Request):
                     # Prüfe auf UploadFile-Attribute statt isinstance
                     if hasattr(value, "filename") and hasattr(value, "read"):
                         upload_obj = value
-                        print(f"[API] Upload gefunden in Feld: '{key}'")
+                        api_log.debug("Upload gefunden in Feld: '%s'", key)
                         break
 
             if upload_obj and hasattr(upload_obj, "filename") and upload_obj.filename:
                 raw_filename = upload_obj.filename
-                print(f"[API] Roher Filename: '{raw_filename}'")
+                api_log.debug("Roher Filename: '%s'", raw_filename)
 
                 # Bereinigung des Dateinamens
-                final_name = raw_filename.strip()
-                final_name = re.sub(r'["\']', "", final_name)
-
-                if not final_name.lower().endswith(".nzb"):
-                    final_name += ".nzb"
+                final_name = clean_nzb_name(raw_filename)
 
-                print(f"[API] Bereinigter Filename: '{final_name}'")
+                api_log.debug("Bereinigter Filename: '%s'", final_name)
 
                 # Kopiere Datei ins Blackhole-Verzeichnis
                 file_path = os.path.join(BLACKHOLE_DIR, final_name)
-                print(f"[API] Ziel-Pfad: {file_path}")
-                print(f"[API] Blackhole-Dir existiert: {os.path.exists(BLACKHOLE_DIR)}")
 
                 try:
-                    await upload_obj.seek(0)
-                    content = await upload_obj.read()
-                    print(f"[API] Gelesene Bytes: {len(content)}")
-
-                    with open(file_path, "wb") as buffer:
-                        buffer.write(content)
-
-                    # Überprüfe ob Datei existiert
-                    if os.path.exists(file_path):
-                        file_size = os.path.getsize(file_path)
-                        print(f"[OK] NZB erfolgreich kopiert!")
-                        print(f"[OK] Dateigröße: {file_size} Bytes")
-                        print(f"[OK] Pfad: {file_path}")
+                    (
+                        nzb_file,
+                        file_size,
+                        nzb_digest,
+                        duplicate_ids,
+                    ) = await spool_upload_to_blackhole(upload_obj, file_path)
+                    UPLOAD_BYTES.labels().observe(file_size)
+                    if duplicate_ids is not None:
+                        api_log.info(
+                            "Duplikat erkannt: %s (%s) -> %s",
+                            final_name,
+                            nzb_digest[:12],
+                            duplicate_ids,
+                        )
                     else:
-                        print(f"[ERROR] Datei wurde NICHT erstellt!")
+                        api_log.info("NZB kopiert: %s (%s Bytes)", file_path, file_size)
 
                 except Exception as copy_error:
-                    print(f"[ERROR] Kopierfehler: {copy_error}")
-                    import traceback
-
-                    traceback.print_exc()
+                    api_log.exception("Kopierfehler: %s", copy_error)
+                    # Weiterleitung trotzdem direkt aus dem Upload-Spool
+                    await upload_obj.seek(0)
+                    nzb_file = upload_obj.file
             else:
-                print(f"[WARN] Kein UploadFile gefunden!")
+                api_log.warning("Kein UploadFile gefunden!")
 
                 # Versuche filename aus 'name' Feld zu extrahieren (falls String)
                 if "name" in form_data:
                     name_value = form_data["name"]
-                    print(f"[API] 'name' Feld Typ: {type(name_value)}")
-                    print(f"[API] 'name' Feld Wert: {name_value}")
+                    api_log.debug(
+                        "'name' Feld: %s = %s", type(name_value).__name__, name_value
+                    )
 
                     # Wenn es ein String ist, extrahiere den Filename
                     if isinstance(name_value, str):
@@ -247,8 +2248,8 @@ async def sabnzbd_api(request: Request):
                         match = re.search(r'filename=["\']([^"\']+)["\']', name_value)
                         if match:
                             final_name = match.group(1).strip()
-                            print(
-                                f"[API] Filename aus String extrahiert: '{final_name}'"
+                            api_log.debug(
+                                "Filename aus String extrahiert: '%s'", final_name
                             )
                         else:
                             final_name = name_value.strip()
@@ -258,13 +2259,10 @@ async def sabnzbd_api(request: Request):
                 if final_name and not final_name.lower().endswith(".nzb"):
                     final_name += ".nzb"
 
-                print(f"[WARN] Verwende Name: '{final_name}'")
+                api_log.warning("Verwende Name: '%s'", final_name)
 
         except Exception as e:
-            print(f"[ERROR] API POST Fehler: {e}")
-            import traceback
-
-            traceback.print_exc()
+            api_log.exception("API POST Fehler: %s", e)
 
     elif request.method == "GET":
         if "name" in params:
@@ -272,65 +2270,74 @@ async def sabnzbd_api(request: Request):
             final_name = re.sub(r'["\']', "", final_name)
             if not final_name.lower().endswith(".nzb"):
                 final_name += ".nzb"
-            print(f"[API] GET Request mit name: '{final_name}'")
+            api_log.debug("GET Request mit name: '%s'", final_name)
 
-    # Logging in die Datenbank
-    print(f"[DB] Speichere in History: '{final_name}'")
-    try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute(
-                "INSERT INTO history (info, time, mode, status) VALUES (?, datetime('now','localtime'), ?, ?)",
-                (final_name, str(mode), "200"),
-            )
-            conn.commit()
-        print(f"[DB] Erfolgreich gespeichert")
-    except Exception as db_error:
-        print(f"[ERROR] DB Fehler: {db_error}")
+    # Logging in die Datenbank (asynchron ueber den History-Writer)
+    db_log.debug("Speichere in History: '%s'", final_name)
+    history_writer.enqueue(
+        final_name, str(mode), "DUP" if duplicate_ids is not None else "200"
+    )
 
-    print(f"{'='*60}\n")
+    # Duplikat: urspruengliche nzo_ids, kein Blackhole-Write, kein Backend-Call
+    if duplicate_ids is not None:
+        request.state.outcome = "duplicate"
+        return JSONResponse({"status": True, "nzo_ids": duplicate_ids})
 
     # Erweitertes Antwort-Format für Sonarr/Radarr Validierung
-# --- TRANSPARENT PROXY / WEITERLEITUNG AN ALTMOUNT ---
-    try:
-        async with httpx.AsyncClient() as client:
-            if mode in ["addfile", "addurl"] and request.method == "POST":
-                # Filtert form_data: Nur Strings behalten, UploadFile-Objekte ignorieren
-                # (da diese separat über 'files' gesendet werden)
-                filtered_data = {}
-                for key, value in form_data.items():
-                    if isinstance(value, str):
-                        filtered_data[key] = value
-                
-                # Wir bauen den Request für Altmount nach
-                # Die Datei 'content' haben wir ja bereits oben im Code eingelesen
-                files = {'nzbfile': (final_name, content)}
-                
-                altmount_resp = await client.post(
-                    BACKEND_URL,
-                    params=params,
-                    data=filtered_data,
-                    files=files,
-                    timeout=15.0
-                )
-            else:
-                # Für get_config, queue etc. (GET Requests)
-                altmount_resp = await client.get(
-                    BACKEND_URL,
-                    params=params,
-                    timeout=5.0
-                )
+    # --- TRANSPARENT PROXY / WEITERLEITUNG AN ALTMOUNT ---
+    if mode in UPLOAD_MODES and request.method == "POST":
+        # Filtert form_data: Nur Strings behalten, UploadFile-Objekte ignorieren
+        # (da diese separat über 'files' gesendet werden)
+        filtered_data = {}
+        for key, value in form_data.items():
+            if isinstance(value, str):
+                filtered_data[key] = value
+
+        # Wir bauen den Request für Altmount nach
+        # Die NZB wird direkt aus der Blackhole-Datei gestreamt
+        files = None
+        if nzb_file is not None:
+            files = {"nzbfile": (final_name, nzb_file, "application/x-nzb")}
 
-            if altmount_resp.status_code == 200:
-                print(f"[API] Weiterleitung an Altmount erfolgreich")
-                return JSONResponse(content=altmount_resp.json())
-            else:
-                print(f"[API] Altmount antwortete mit Status: {altmount_resp.status_code}")
-                
-    except Exception as e:
-        print(f"[PROXY ERROR] Weiterleitung zu Altmount ({BACKEND_URL}) fehlgeschlagen: {e}")
+        try:
+            result = await forward_to_backend(
+                mode, params, data=filtered_data, files=files
+            )
+        finally:
+            if nzb_file is not None:
+                nzb_file.close()
+    elif mode in CACHE_TTLS and not mutates_backend(mode, params):
+        # Read-only Modes: gecacht, parallele identische Anfragen teilen sich einen Call
+        result = await response_cache.get_or_fetch(
+            make_cache_key(params),
+            CACHE_TTLS[mode],
+            lambda: forward_to_backend(mode, params),
+        )
+    else:
+        # Aktionen (queue/history mit name=delete, pause, ...) und sonstige Modes
+        result = await forward_to_backend(mode, params)
+
+    if mutates_backend(mode, params):
+        # Nach Aenderungen keine alten queue/history-Antworten mehr ausliefern
+        response_cache.invalidate()
+
+    if mode in UPLOAD_MODES:
+        # Hash nur mit echten nzo_ids merken: nach einem Fallback muss der
+        # Retry der *arrs Altmount wieder erreichen
+        nzo_ids = backend_nzo_ids(result)
+        if nzb_digest is not None and nzo_ids:
+            try:
+                await asyncio.to_thread(store_nzb_hash, nzb_digest, nzo_ids, final_name)
+            except Exception as e:
+                db_log.error("Dedup-Hash nicht gespeichert: %s", e)
+
+    if result is not None:
+        request.state.outcome = "proxied"
+        return result.to_response()
 
     # --- FALLBACK ---
-    if mode in ["addfile", "addurl"]:
+    request.state.outcome = "fallback"
+    if mode in UPLOAD_MODES:
         return JSONResponse({"status": True, "nzo_ids": ["proxy_added"]})
 
     return JSONResponse(
@@ -338,18 +2345,93 @@ async def sabnzbd_api(request: Request):
             "status": True,
             "version": "3.0.0",
             "queue": {
-                "status": "Idle", "speed": "0", "size": "0 B", "sizeleft": "0 B",
-                "slots": [], "noofslots": 0, "paused": False, "version": "3.0.0",
-                "finish": 0, "cache_size": "0 B",
+                "status": "Idle",
+                "speed": "0",
+                "size": "0 B",
+                "sizeleft": "0 B",
+                "slots": [],
+                "noofslots": 0,
+                "paused": False,
+                "version": "3.0.0",
+                "finish": 0,
+                "cache_size": "0 B",
             },
             "server_stats": {
-                "total_size": "0 B", "month_size": "0 B", "week_size": "0 B", "day_size": "0 B",
+                "total_size": "0 B",
+                "month_size": "0 B",
+                "week_size": "0 B",
+                "day_size": "0 B",
             },
         }
     )
 
+
+# --- BULK-IMPORT ---
+@router.post("/import")
+async def bulk_import(request: Request, username: str = Depends(get_current_user)):
+    """
+    Importiert ein zip/tar(.gz) voller NZBs (Feld `archive`) oder alle NZBs
+    eines Verzeichnisses unter IMPORT_DIR (Feld `directory`). Weitere
+    Formularfelder (cat, priority, ...) gehen wie bei addfile an Altmount.
+    """
+    if username != PROXY_USER:
+        return JSONResponse({"status": False, "error": "unauthorized"}, status_code=401)
+    # Kein Import per Cross-Site-Formular: fremde Origins abweisen
+    origin = request.headers.get("origin")
+    if origin and origin.split("://", 1)[-1] != request.headers.get("host"):
+        return JSONResponse({"status": False, "error": "forbidden"}, status_code=403)
+
+    form_data = await request.form()
+    params = {k: v for k, v in request.query_params.items()}
+    params["mode"] = "addfile"
+    data = {
+        key: value
+        for key, value in form_data.items()
+        if isinstance(value, str) and key != "directory"
+    }
+    archive = form_data.get("archive")
+    directory = form_data.get("directory")
+    workdir = None
+    try:
+        if archive is not None and hasattr(archive, "read"):
+            workdir = await asyncio.to_thread(tempfile.mkdtemp, prefix="nzb-import-")
+            uploads = await asyncio.to_thread(
+                prepare_nzb_archive,
+                archive.file,
+                archive.filename or "archive",
+                workdir,
+            )
+        elif isinstance(directory, str) and directory:
+            if not IMPORT_DIR:
+                return JSONResponse(
+                    {
+                        "status": False,
+                        "error": "Verzeichnis-Import deaktiviert (IMPORT_DIR)",
+                    },
+                    status_code=400,
+                )
+            paths = await asyncio.to_thread(scan_import_dir, directory)
+            uploads = [(path, functools.partial(open, path, "rb")) for path in paths]
+        else:
+            return JSONResponse(
+                {"status": False, "error": "archive oder directory fehlt"},
+                status_code=400,
+            )
+
+        if not uploads:
+            return JSONResponse(
+                {"status": False, "error": "keine NZBs gefunden"}, status_code=400
+            )
+        return JSONResponse(await ingest_bulk(uploads, "addfile", params, data))
+    except ValueError as e:
+        return JSONResponse({"status": False, "error": str(e)}, status_code=400)
+    finally:
+        if workdir is not None:
+            await asyncio.to_thread(shutil.rmtree, workdir, True)
+
+
 # --- DASHBOARD ROUTE ---
-@app.api_route("/", methods=["GET", "POST"], response_class=HTMLResponse)
+@router.api_route("/", methods=["GET", "POST"], response_class=HTMLResponse)
 async def dashboard(
     request: Request,
     page_t: int = 1,
@@ -358,46 +2440,65 @@ async def dashboard(
     search_t: str = "",
     search_h: str = "",
     content_only: int = 0,
+    before_h: int = 0,
+    after_h: int = 0,
     username: str = Depends(get_current_user),
 ):
     if not username:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
+    if page_h <= 1:
+        before_h = after_h = 0
+
+    # Fragment-Cache: unveraenderte Refreshes ohne DB-Abfrage und Rendering
+    fragment_key, etag = None, None
+    try:
+        stats_version, mode_counts = history_stats_cache.get()
+    except sqlite3.Error:
+        stats_version, mode_counts = -1, {}
+    if content_only == 1:
+        state = dashboard_events.state()
+        # Gefilterte Ansicht haengt nur an Uploads, ungefilterte an allen Zeilen
+        state.pop("history" if filter_active else "uploads")
+        fragment_key = (
+            page_t,
+            page_h,
+            filter_active,
+            search_t,
+            search_h,
+            before_h,
+            after_h,
+            stats_version,
+            # Backend-Gesundheit steckt als health_version im State; die
+            # EWMA-Werte im Footer aendern den ETag bewusst nicht
+            *state.values(),
+        )
+        etag = fragment_cache.etag(fragment_key)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        body = fragment_cache.get(fragment_key)
+        if body is not None:
+            return Response(body, media_type="application/json", headers=headers)
+
     # Torbox Tabelle (wird nur gefüllt wenn API Daten liefert)
-    t_filtered = (
-        [
-            i
-            for i in torbox_memory_cache
-            if search_t.lower().strip() in i["name"].lower()
-        ]
-        if search_t
-        else torbox_memory_cache
-    )
-    total_t_pages = max(1, math.ceil(len(t_filtered) / ITEMS_PER_PAGE))
-    torbox_list = t_filtered[(page_t - 1) * ITEMS_PER_PAGE : page_t * ITEMS_PER_PAGE]
+    torbox_list, total_t_pages = [], 1
+    snapshot = torbox_snapshot
+    if snapshot is not None:
+        torbox_list, total_t_pages = snapshot.page(search_t, page_t)
 
     # Altmount Tabelle
     altmount_data, total_h = [], 0
+    dedup = {"hit": 0, "miss": 0}
     try:
         with sqlite3.connect(DB_PATH) as conn:
             conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            h_query = "SELECT * FROM history WHERE 1=1"
-            h_params = []
-            if filter_active:
-                h_query += " AND mode IN ('addfile', 'addurl')"
-            if search_h:
-                h_query += " AND info LIKE ?"
-                h_params.append(f"%{search_h.strip()}%")
-
-            cursor.execute(f"SELECT COUNT(*) FROM ({h_query})", h_params)
-            total_h = cursor.fetchone()[0]
-            cursor.execute(
-                f"{h_query} ORDER BY id DESC LIMIT ? OFFSET ?",
-                (*h_params, ITEMS_PER_PAGE, (page_h - 1) * ITEMS_PER_PAGE),
+            started = time.perf_counter()
+            raw_rows, total_h = query_history(
+                conn, filter_active, search_h, page_h, before_h, after_h
             )
-
-            raw_rows = [dict(row) for row in cursor.fetchall()]
+            HISTORY_READ.labels().observe(time.perf_counter() - started)
+            dedup.update(conn.execute("SELECT name, count FROM dedup_stats").fetchall())
             for log in raw_rows:
                 log["display_name"] = log.get("info", "Unknown NZB")
             altmount_data = raw_rows
@@ -405,9 +2506,14 @@ async def dashboard(
         pass
 
     total_h_pages = max(1, math.ceil(total_h / ITEMS_PER_PAGE))
+    # Anzeige: Gesamtzahl aller jemals protokollierten Requests (history_hourly)
+    if filter_active:
+        total_history = sum(mode_counts.get(m, 0) for m in UPLOAD_MODES)
+    else:
+        total_history = sum(mode_counts.values())
 
     if content_only == 1:
-        return JSONResponse(
+        body = json.dumps(
             {
                 "status": "success",
                 "table_html": templates.get_template("torbox_table.html").render(
@@ -415,6 +2521,7 @@ async def dashboard(
                         "torbox_downloads": torbox_list,
                         "page_t": page_t,
                         "total_t_pages": total_t_pages,
+                        "torbox_stale": torbox_stale,
                     }
                 ),
                 "history_html": templates.get_template("altmount_table.html").render(
@@ -422,11 +2529,19 @@ async def dashboard(
                         "request_log": altmount_data,
                         "page_h": page_h,
                         "total_h_pages": total_h_pages,
+                        "dedup_hits": dedup["hit"],
+                        "dedup_misses": dedup["miss"],
                     }
                 ),
-                "total_history": total_h,
+                "total_history": total_history,
+                "mode_counts": mode_counts,
+                "backend_html": templates.get_template("backend_status.html").render(
+                    {"backends": backend_pool.stats()}
+                ),
             }
-        )
+        ).encode("utf-8")
+        fragment_cache.put(fragment_key, body)
+        return Response(body, media_type="application/json", headers=headers)
 
     return templates.TemplateResponse(
         "dashboard.html",
@@ -436,15 +2551,62 @@ async def dashboard(
             "request_log": altmount_data,
             "page_t": page_t,
             "total_t_pages": total_t_pages,
+            "torbox_stale": torbox_stale,
             "page_h": page_h,
             "total_h_pages": total_h_pages,
-            "total_history": total_h,
+            "total_history": total_history,
         },
     )
 
 
+# --- DASHBOARD EVENTS (SSE) ---
+@router.get("/events")
+async def dashboard_event_stream(
+    request: Request, username: str = Depends(get_current_user)
+):
+    """
+    Pusht den Aenderungsstand (TorBox-Version, History-IDs) an das Dashboard.
+    Das Dashboard laedt die Tabellen nur nach, wenn sich etwas geaendert hat.
+    """
+    if not username:
+        return JSONResponse({"status": "unauthorized"}, status_code=401)
+
+    async def stream():
+        last_state = None
+        closes_at = time.monotonic() + SSE_MAX_LIFETIME
+        yield f"retry: {int(SSE_KEEPALIVE * 1000)}\n\n"
+        # Beim Shutdown sofort enden, sonst wartet uvicorn auf offene Streams
+        # und der Lifespan-Teardown (History-Flush, Lease) laeuft nie
+        while not shutting_down.is_set() and time.monotonic() < closes_at:
+            if await request.is_disconnected():
+                break
+            state = dashboard_events.state()
+            if state != last_state:
+                yield f"data: {json.dumps(state)}\n\n"
+                last_state = state
+                # Aenderungsschuebe (z.B. History-Batches) zusammenfassen
+                await asyncio.sleep(SSE_MIN_INTERVAL)
+                continue
+            if not await dashboard_events.wait(SSE_KEEPALIVE):
+                yield ": ping\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- METRICS ---
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 # --- LOGIN / LOGOUT ---
-@app.api_route("/login", methods=["GET", "POST"], response_class=HTMLResponse)
+@router.api_route("/login", methods=["GET", "POST"], response_class=HTMLResponse)
 async def login(request: Request):
     if request.method == "POST":
         try:
@@ -468,7 +2630,7 @@ async def login(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 
-@app.get("/logout")
+@router.get("/logout")
 async def logout():
     response = RedirectResponse(url="/login")
     response.delete_cookie("user")
@@ -480,15 +2642,219 @@ async def torbox_update_loop():
     Dieser Loop sorgt dafür, dass die torbox_table (linke Seite)
     regelmäßig mit frischen Daten von der TorBox API versorgt wird.
     """
+    global torbox_db_rows
+    next_poll = 0.0
+    is_leader = False
+    while True:
+        try:
+            was_leader = is_leader
+            is_leader = await asyncio.to_thread(acquire_poller_lease, POLLER_ID)
+            if is_leader and not was_leader:
+                torbox_log.info("Poller-Lease uebernommen (%s)", POLLER_ID)
+                # DB-Stand koennte von einem anderen Worker stammen
+                torbox_db_rows = None
+                next_poll = 0.0
+            if is_leader:
+                if time.monotonic() >= next_poll:
+                    success = await fetch_torbox_to_db()
+                    next_poll = time.monotonic() + next_torbox_interval(success)
+            else:
+                await reload_shared_torbox()
+            # History-Stand anderer Worker fuer SSE/ETag mitbekommen
+            await asyncio.to_thread(history_writer.refresh_high_water)
+        except Exception as e:
+            torbox_log.warning("TorBox-Loop Fehler: %s", e)
+        wait = TORBOX_SHARED_CHECK
+        if is_leader:
+            wait = min(TORBOX_LEASE_TTL / 3, max(0.1, next_poll - time.monotonic()))
+        await asyncio.sleep(wait)
+
+
+async def reload_shared_torbox():
+    """Follower: uebernimmt den Snapshot des Pollers nur bei neuer Version."""
+    global torbox_snapshot, torbox_stale
+    current = torbox_snapshot.version if torbox_snapshot else -1
+    version, stale, items = await asyncio.to_thread(load_shared_torbox, current)
+    before = (torbox_snapshot, torbox_stale)
+    if items is not None:
+        torbox_snapshot = TorboxSnapshot(items, version)
+        TORBOX_ITEMS.labels().set(len(items))
+    torbox_stale = stale
+    if (torbox_snapshot, torbox_stale) != before:
+        dashboard_events.notify()
+
+
+async def backend_health_loop():
+    """Prueft alle Backends regelmaessig per mode=version."""
+    while True:
+        if backend_client is not None:
+            await backend_pool.probe_all(backend_client)
+        await asyncio.sleep(BACKEND_HEALTH_INTERVAL)
+
+
+async def history_maintenance_loop():
+    """Periodische Retention/Compaction; bei mehreren Workern nur der Poller."""
+    global history_maintenance_runs
+    await asyncio.sleep(60)
+    while True:
+        try:
+            if await asyncio.to_thread(holds_poller_lease, POLLER_ID):
+                started = time.perf_counter()
+                result = await asyncio.to_thread(run_history_maintenance)
+                HISTORY_MAINTENANCE.labels().observe(time.perf_counter() - started)
+                db_log.info("History-Wartung: %s", result)
+                if result["deleted"] or result["archived"]:
+                    history_maintenance_runs += 1
+                    dashboard_events.notify()
+        except Exception as e:
+            db_log.error("History-Wartung fehlgeschlagen: %s", e)
+        await asyncio.sleep(HISTORY_MAINTENANCE_INTERVAL)
+
+
+async def event_loop_lag_monitor(interval: float = 0.5):
+    """Misst, wie viel spaeter als geplant der Loop einen Sleep beendet."""
     while True:
-        await fetch_torbox_to_db()
-        await asyncio.sleep(10)  # Aktualisierung alle 10 Sekunden
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.labels().observe(
+            max(0.0, time.perf_counter() - started - interval)
+        )
+
+
+# Wird beim ersten SIGTERM/SIGINT gesetzt und beendet offene SSE-Streams
+shutting_down = asyncio.Event()
+
+
+def install_shutdown_hook():
+    """
+    Haengt sich vor uvicorns Signal-Handler: offene /events-Streams enden
+    sofort, damit uvicorn nicht bis zum Graceful-Timeout auf sie wartet.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+
+    def chain(previous):
+        def handler(signum, frame):
+            loop.call_soon_threadsafe(shutting_down.set)
+            loop.call_soon_threadsafe(dashboard_events.notify)
+            if callable(previous):
+                previous(signum, frame)
+
+        return handler
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, chain(signal.getsignal(sig)))
+
+
+# Status der Startup-Pruefungen fuer /ready
+readiness = {"db": False, "blackhole": False}
 
 
-@app.on_event("startup")
-async def startup_event():
+def check_db_alive() -> bool:
+    try:
+        with sqlite3.connect(DB_PATH, timeout=2) as conn:
+            conn.execute("SELECT 1").fetchone()
+        return True
+    except sqlite3.Error:
+        return False
+
+
+@router.get("/health")
+async def health():
+    """Liveness: Prozess antwortet und die DB laesst sich oeffnen."""
+    ok = await asyncio.to_thread(check_db_alive)
+    return JSONResponse(
+        {"status": "ok" if ok else "error", "checks": {"db": ok}},
+        status_code=200 if ok else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@router.get("/ready")
+async def ready():
+    """Readiness: DB migriert, Blackhole beschreibbar, mindestens ein Backend gesund."""
+    checks = {
+        **readiness,
+        "backend": any(b.healthy for b in backend_pool.backends),
+    }
+    ok = all(checks.values())
+    return JSONResponse(
+        {"status": "ready" if ok else "starting", "checks": checks},
+        status_code=200 if ok else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global backend_client
+    started = time.perf_counter()
+    setup_logging()
+    log_config()
+    shutting_down.clear()
+    install_shutdown_hook()
+    # Ein langlebiger Client mit Keep-Alive fuer alle Weiterleitungen an Altmount
+    backend_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=BACKEND_MAX_CONNECTIONS,
+            max_keepalive_connections=BACKEND_MAX_KEEPALIVE,
+            keepalive_expiry=BACKEND_KEEPALIVE_EXPIRY,
+        ),
+        timeout=BACKEND_TIMEOUT_DEFAULT,
+    )
+    # Dateisystem, Migrationen, Templates und erste Backend-Probe parallel
+    blackhole_ok, db_error, _, _ = await asyncio.gather(
+        asyncio.to_thread(prepare_blackhole),
+        asyncio.to_thread(init_db),
+        asyncio.to_thread(precompile_templates),
+        backend_pool.probe_all(backend_client),
+        return_exceptions=True,
+    )
+    if isinstance(db_error, BaseException):
+        db_log.critical("Datenbank-Initialisierung fehlgeschlagen: %s", db_error)
+        await backend_client.aclose()
+        raise db_error
+    readiness["db"] = True
+    readiness["blackhole"] = blackhole_ok is True
+
+    loop = asyncio.get_running_loop()
+    history_writer.on_change = lambda: loop.call_soon_threadsafe(
+        dashboard_events.notify
+    )
+    history_writer.start()
     # Startet den dauerhaften Hintergrund-Loop für die TorBox-Tabelle
-    asyncio.create_task(torbox_update_loop())
+    tasks = [
+        asyncio.create_task(torbox_update_loop()),
+        asyncio.create_task(event_loop_lag_monitor()),
+        asyncio.create_task(backend_health_loop()),
+        asyncio.create_task(history_maintenance_loop()),
+    ]
+    elapsed = time.perf_counter() - started
+    STARTUP_SECONDS.labels().set(elapsed)
+    log.info("Startklar nach %.0f ms (ready=%s)", elapsed * 1000, readiness)
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await backend_client.aclose()
+        backend_client = None
+        # Ausstehende History-Zeilen noch schreiben
+        await asyncio.to_thread(history_writer.stop)
+        # Lease freigeben, damit ein anderer Worker sofort uebernimmt
+        await asyncio.to_thread(release_poller_lease, POLLER_ID)
+
+
+def create_app() -> FastAPI:
+    """App-Factory: der Import von main.py bleibt frei von I/O."""
+    application = FastAPI(lifespan=lifespan)
+    application.add_middleware(CompressionMiddleware)
+    application.add_middleware(RequestIdMiddleware)
+    application.include_router(router)
+    return application
+
+
+app = create_app()
 
 
 if __name__ == "__main__":